@@ -0,0 +1,168 @@
+"""
+Login Activity
+Write-behind buffer for login activity. Logins update per-user counters in
+memory; a background thread writes them to the users table in one batched
+UPDATE per interval or when enough users are pending, and on shutdown. With
+sharding, each shard gets its own batch.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime
+from sqlalchemy import DateTime, String, bindparam, func
+
+logger = logging.getLogger(__name__)
+
+
+class LoginActivityBuffer:
+    """Aggregates login outcomes per user and flushes them in batches"""
+
+    def __init__(self, engine, table, flush_interval=5.0, flush_size=1000, max_pending=100000, shard_engines=None):
+        self.engine = engine
+        self.table = table
+        self.shard_engines = shard_engines or {}
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.flushed_users = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self._statement = self._build_statement()
+
+    def _build_statement(self):
+        table = self.table
+        # Bind names must differ from column names in an executemany UPDATE
+        return table.update().where(table.c.id == bindparam('b_id')).values(
+            login_count=table.c.login_count + bindparam('b_successes'),
+            failed_login_count=table.c.failed_login_count + bindparam('b_failures'),
+            last_login_at=func.coalesce(bindparam('b_last_login_at', type_=DateTime()), table.c.last_login_at),
+            last_login_ip=func.coalesce(bindparam('b_last_login_ip', type_=String()), table.c.last_login_ip),
+            # Activity is not a profile change: keep updated_at (and anything keyed on it) as is
+            updated_at=table.c.updated_at
+        )
+
+    def record(self, user_id, success, ip=None, shard=None):
+        """Count one login attempt for an existing user, stored on shard when sharded"""
+        self._ensure_thread()
+        key = (shard, user_id)
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                if len(self._pending) >= self.max_pending:
+                    self.dropped += 1
+                    return
+                entry = self._pending[key] = {'b_id': user_id, 'b_successes': 0, 'b_failures': 0,
+                                                  'b_last_login_at': None, 'b_last_login_ip': None}
+            if success:
+                entry['b_successes'] += 1
+                entry['b_last_login_at'] = datetime.utcnow()
+                entry['b_last_login_ip'] = ip
+            else:
+                entry['b_failures'] += 1
+            full = len(self._pending) >= self.flush_size
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Write all pending activity now; failed batches are kept for the next flush"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            by_shard = {}
+            for key, entry in batch.items():
+                by_shard.setdefault(key[0], {})[key] = entry
+            flushed = 0
+            for shard, entries in by_shard.items():
+                try:
+                    with self.shard_engines.get(shard, self.engine).begin() as connection:
+                        connection.execute(self._statement, list(entries.values()))
+                except Exception:
+                    self.failures += 1
+                    logger.exception('Login activity flush failed for %d users', len(entries))
+                    self._requeue(entries)
+                    continue
+                flushed += len(entries)
+                self.batches += 1
+            self.flushed_users += flushed
+            return flushed
+
+    def _requeue(self, batch):
+        """Merge a failed batch back in front of activity recorded since"""
+        with self._lock:
+            for key, entry in batch.items():
+                newer = self._pending.get(key)
+                if newer is None:
+                    if len(self._pending) >= self.max_pending:
+                        self.dropped += 1
+                        continue
+                    self._pending[key] = entry
+                else:
+                    newer['b_successes'] += entry['b_successes']
+                    newer['b_failures'] += entry['b_failures']
+                    if newer['b_last_login_at'] is None:
+                        newer['b_last_login_at'] = entry['b_last_login_at']
+                        newer['b_last_login_ip'] = entry['b_last_login_ip']
+
+    def _ensure_thread(self):
+        """Start the flusher on first use in each process (threads do not survive fork)"""
+        if self._pid == os.getpid() or self._stopping.is_set():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='login-activity', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        """Stop the flusher and write whatever is still buffered"""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def stats(self):
+        """Return buffered entries and flush counters"""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'pending_users': pending,
+            'flushed_users': self.flushed_users,
+            'batches': self.batches,
+            'failures': self.failures,
+            'dropped': self.dropped
+        }
+
+
+def create_login_activity(app, db, User, shard_router=None):
+    """Build the activity buffer from app config, or None when LOGIN_ACTIVITY is off"""
+    if not app.config.get('LOGIN_ACTIVITY', True):
+        return None
+    with app.app_context():
+        engine = db.engine
+        shard_engines = shard_router.engines() if shard_router is not None else None
+    return LoginActivityBuffer(
+        engine,
+        User.__table__,
+        flush_interval=app.config.get('LOGIN_ACTIVITY_FLUSH_INTERVAL', 5),
+        flush_size=app.config.get('LOGIN_ACTIVITY_FLUSH_SIZE', 1000),
+        max_pending=app.config.get('LOGIN_ACTIVITY_MAX_PENDING', 100000),
+        shard_engines=shard_engines
+    )
@@ -1,89 +1,328 @@
 """
 Flask Application - Main Entry Point
 A secure, modular Flask application with JWT authentication and SQLAlchemy ORM.
+
+Importing this module is cheap: the app, its extensions, model and routes are
+built by create_app(), and the heavy imports happen on its first call.
 """
 
+import atexit
+import logging
 import os
-from flask import Flask, jsonify, request, render_template
-from flask_sqlalchemy import SQLAlchemy
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from dotenv import load_dotenv
-import bcrypt
+import time
 from datetime import timedelta
+from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Flask app
-app = Flask(__name__)
-
-# Configuration
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default-secret-key')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///app.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'default-jwt-secret')
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=int(os.getenv('JWT_ACCESS_TOKEN_EXPIRES', 1)))
-
-# Initialize extensions
-db = SQLAlchemy(app)
-jwt = JWTManager(app)
-
-# Import models and routes after db initialization
-from models import create_user_model
-from routes import create_routes
-
-# Create models and routes
-User = create_user_model(db)
-auth_bp, user_bp = create_routes(db, User)
-
-# Register blueprints
-app.register_blueprint(auth_bp, url_prefix='/auth')
-app.register_blueprint(user_bp, url_prefix='/users')
-
-@app.route('/')
-def index():
-    """Home page route"""
-    return render_template('index.html')
-
-@app.route('/api')
-def api_info():
-    """API information endpoint"""
-    return jsonify({
-        'message': 'Flask Application API',
-        'version': '1.0.0',
-        'endpoints': {
-            'auth': '/auth',
-            'users': '/users'
-        }
-    })
-
-@app.route('/health')
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'database': 'connected' if db.engine.pool.checkedin() >= 0 else 'disconnected'
-    })
-
-@app.errorhandler(404)
-def not_found(error):
-    """404 error handler"""
-    return jsonify({'error': 'Resource not found'}), 404
-
-@app.errorhandler(500)
-def internal_error(error):
-    """500 error handler"""
-    db.session.rollback()
-    return jsonify({'error': 'Internal server error'}), 500
+logger = logging.getLogger(__name__)
+
+
+def env_flag(name, default):
+    """Read a 'true'/'false' environment variable"""
+    return os.getenv(name, default).lower() == 'true'
+
+
+def load_config():
+    """Read the application configuration from environment variables"""
+    return {
+        'SECRET_KEY': os.getenv('SECRET_KEY', 'default-secret-key'),
+        'SQLALCHEMY_DATABASE_URI': os.getenv('DATABASE_URL', 'sqlite:///app.db'),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SCHEMA_AUTO_CREATE': env_flag('SCHEMA_AUTO_CREATE', 'true'),
+        'SHARD_DATABASE_URLS': os.getenv('SHARD_DATABASE_URLS', ''),
+        'SHARD_REBALANCING': env_flag('SHARD_REBALANCING', 'false'),
+        'SHARD_FANOUT_WORKERS': int(os.getenv('SHARD_FANOUT_WORKERS', 0)),
+        'REPLICA_DATABASE_URL': os.getenv('REPLICA_DATABASE_URL', ''),
+        'REPLICA_READ_YOUR_WRITES_SECONDS': float(os.getenv('REPLICA_READ_YOUR_WRITES_SECONDS', 5)),
+        'REPLICA_CHECK_INTERVAL': float(os.getenv('REPLICA_CHECK_INTERVAL', 5)),
+        'REPLICA_MAX_TRACKED_WRITERS': int(os.getenv('REPLICA_MAX_TRACKED_WRITERS', 100000)),
+        'SQLITE_TUNING': env_flag('SQLITE_TUNING', 'true'),
+        'SQLITE_WAL': env_flag('SQLITE_WAL', 'true'),
+        'SQLITE_BUSY_TIMEOUT_MS': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        'SQLITE_CACHE_SIZE_KB': int(os.getenv('SQLITE_CACHE_SIZE_KB', 65536)),
+        'SQLITE_MMAP_SIZE': int(os.getenv('SQLITE_MMAP_SIZE', 268435456)),
+        'JWT_SECRET_KEY': os.getenv('JWT_SECRET_KEY', 'default-jwt-secret'),
+        'JWT_ACCESS_TOKEN_EXPIRES': timedelta(hours=int(os.getenv('JWT_ACCESS_TOKEN_EXPIRES', 1))),
+        'PASSWORD_POOL_WORKERS': int(os.getenv('PASSWORD_POOL_WORKERS', os.cpu_count() or 1)),
+        'PASSWORD_POOL_QUEUE': int(os.getenv('PASSWORD_POOL_QUEUE', 32)),
+        'PASSWORD_POOL_RETRY_AFTER': int(os.getenv('PASSWORD_POOL_RETRY_AFTER', 1)),
+        'BCRYPT_ROUNDS': int(os.getenv('BCRYPT_ROUNDS', 12)),
+        'BCRYPT_CALIBRATE': env_flag('BCRYPT_CALIBRATE', 'false'),
+        'BCRYPT_TARGET_MS': int(os.getenv('BCRYPT_TARGET_MS', 50)),
+        'USER_CACHE_SIZE': int(os.getenv('USER_CACHE_SIZE', 10000)),
+        'USER_CACHE_TTL': int(os.getenv('USER_CACHE_TTL', 60)),
+        'PROFILE_CLAIMS': env_flag('PROFILE_CLAIMS', 'false'),
+        'REGISTER_BATCH_MAX': int(os.getenv('REGISTER_BATCH_MAX', 10000)),
+        'LOGIN_THROTTLE': env_flag('LOGIN_THROTTLE', 'true'),
+        'LOGIN_IP_LIMIT': int(os.getenv('LOGIN_IP_LIMIT', 30)),
+        'LOGIN_IP_WINDOW': int(os.getenv('LOGIN_IP_WINDOW', 60)),
+        'LOGIN_IDENTIFIER_LIMIT': int(os.getenv('LOGIN_IDENTIFIER_LIMIT', 10)),
+        'LOGIN_IDENTIFIER_WINDOW': int(os.getenv('LOGIN_IDENTIFIER_WINDOW', 60)),
+        'LOGIN_THROTTLE_MAX_KEYS': int(os.getenv('LOGIN_THROTTLE_MAX_KEYS', 100000)),
+        'LOGIN_ACTIVITY': env_flag('LOGIN_ACTIVITY', 'true'),
+        'LOGIN_ACTIVITY_FLUSH_INTERVAL': float(os.getenv('LOGIN_ACTIVITY_FLUSH_INTERVAL', 5)),
+        'LOGIN_ACTIVITY_FLUSH_SIZE': int(os.getenv('LOGIN_ACTIVITY_FLUSH_SIZE', 1000)),
+        'LOGIN_ACTIVITY_MAX_PENDING': int(os.getenv('LOGIN_ACTIVITY_MAX_PENDING', 100000)),
+        'JOBS_WORKERS': int(os.getenv('JOBS_WORKERS', 2)),
+        'JOBS_MAX_ATTEMPTS': int(os.getenv('JOBS_MAX_ATTEMPTS', 5)),
+        'JOBS_BACKOFF_SECONDS': float(os.getenv('JOBS_BACKOFF_SECONDS', 1)),
+        'JOBS_MAX_BACKOFF_SECONDS': float(os.getenv('JOBS_MAX_BACKOFF_SECONDS', 300)),
+        'JOBS_DATABASE_URL': os.getenv('JOBS_DATABASE_URL', ''),
+        'JOBS_LEASE_SECONDS': float(os.getenv('JOBS_LEASE_SECONDS', 300)),
+        'JOBS_POLL_INTERVAL': float(os.getenv('JOBS_POLL_INTERVAL', 5)),
+        'JSON_PROVIDER': os.getenv('JSON_PROVIDER', 'orjson'),
+        'PAYLOAD_CACHE_SIZE': int(os.getenv('PAYLOAD_CACHE_SIZE', 50000)),
+        'RESPONSE_COMPRESSION': env_flag('RESPONSE_COMPRESSION', 'true'),
+        'COMPRESS_MIN_SIZE': int(os.getenv('COMPRESS_MIN_SIZE', 1024)),
+        'COMPRESS_LEVEL': int(os.getenv('COMPRESS_LEVEL', 6)),
+        'FRONTEND_PRECOMPILE': env_flag('FRONTEND_PRECOMPILE', 'true'),
+        'SEARCH_BUDGET_MS': float(os.getenv('SEARCH_BUDGET_MS', 250)),
+        'HEALTH_CHECK_TTL': float(os.getenv('HEALTH_CHECK_TTL', 2)),
+        'READY_MAX_DB_LATENCY_MS': float(os.getenv('READY_MAX_DB_LATENCY_MS', 250)),
+        'READY_MAX_POOL_SATURATION': float(os.getenv('READY_MAX_POOL_SATURATION', 0.9)),
+        'QUERY_PROFILING': env_flag('QUERY_PROFILING', 'false'),
+        'SLOW_REQUEST_MS': float(os.getenv('SLOW_REQUEST_MS', 500)),
+        'REPEATED_QUERY_THRESHOLD': int(os.getenv('REPEATED_QUERY_THRESHOLD', 2)),
+        'METRICS_DIR': os.getenv('METRICS_DIR', ''),
+        'METRICS_SYNC_INTERVAL': float(os.getenv('METRICS_SYNC_INTERVAL', 1)),
+    }
+
+
+def create_app(config=None):
+    """
+    Build an application instance. Values in config override the environment.
+    The database extension is app.extensions['sqlalchemy'] and the User model
+    app.extensions['user_model']; startup timings are in app.extensions['startup'].
+    """
+    started = time.perf_counter()
+
+    # Deferred so that importing this module costs nothing until an app is needed
+    from flask import Flask, jsonify
+    from flask_sqlalchemy import SQLAlchemy
+    from flask_jwt_extended import JWTManager
+    from database import configure_engines, engine_options_from_env, ensure_schema
+    from replica import configure_replica, create_replica_router, replica_session_options
+    from sharding import configure_sharding, create_shard_router, sharded_session_options
+    from serialization import configure_json, create_payload_cache
+    from hashing import PasswordPoolFull, create_password_pool, resolve_bcrypt_rounds
+    from models import add_lookup_columns, create_user_model
+    from routes import create_routes
+    from cache import bind_user_cache, create_user_cache
+    from claims import create_profile_versions
+    from throttle import LoginThrottled, create_login_throttle
+    from activity import create_login_activity
+    from jobs import create_job_queue
+    from search import create_user_search
+    from metrics import init_metrics
+    from profiling import init_profiling
+    from conditional import init_compression
+    from frontend import init_frontend
+    from cli import create_cli
+    from health import ReadinessProbe
+    imported = time.perf_counter()
+
+    # Initialize Flask app
+    app = Flask(__name__)
+
+    # Configuration
+    app.config.update(load_config())
+    app.config.update(config or {})
+    if 'SQLALCHEMY_ENGINE_OPTIONS' not in (config or {}):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_from_env(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    # Optional read replica as a second bind (REPLICA_DATABASE_URL enables)
+    configure_replica(app.config)
+
+    # Optional user shards as binds shard0..shardN-1 (SHARD_DATABASE_URLS enables)
+    configure_sharding(app.config)
+
+    # Initialize extensions
+    db = SQLAlchemy(app, session_options=sharded_session_options(app.config) or replica_session_options(app.config))
+    JWTManager(app)
+
+    # SQLite WAL and pragmas on every new connection (SQLITE_TUNING=false disables)
+    configure_engines(app, db)
+
+    # Use orjson for responses when installed (JSON_PROVIDER=default opts out)
+    configure_json(app)
+
+    # Dedicated pool for bcrypt work (PASSWORD_POOL_WORKERS=0 hashes inline)
+    password_pool = create_password_pool(app.config)
+
+    # Bcrypt cost, optionally calibrated to BCRYPT_TARGET_MS on this host
+    app.config['BCRYPT_ROUNDS'] = resolve_bcrypt_rounds(app.config)
+
+    # Create models and routes
+    User = create_user_model(db, password_pool, app.config['BCRYPT_ROUNDS'])
+
+    # Users hash-partitioned by username across shards, with an id/email directory on the primary
+    shard_router = create_shard_router(app, db, User)
+
+    # Cache of user records for authenticated reads (USER_CACHE_SIZE=0 disables)
+    user_cache = create_user_cache(app.config)
+    if user_cache is not None:
+        bind_user_cache(db, User, user_cache)
+
+    # Profile snapshots in access tokens, checked against updated_at (PROFILE_CLAIMS=true enables)
+    profile_versions = create_profile_versions(app.config, db, User)
+
+    # Read-only GET handlers use the replica outside each writer's read-your-writes window
+    replica_router = create_replica_router(app, db, User)
+
+    # Per-IP and per-identifier login rate limits (LOGIN_THROTTLE=false disables)
+    login_throttle = create_login_throttle(app.config)
+
+    # Login time, IP and counters buffered and written in batches (LOGIN_ACTIVITY=false disables)
+    login_activity = create_login_activity(app, db, User, shard_router)
+
+    # Post-commit follow-up work on worker threads (JOBS_DATABASE_URL makes it durable)
+    job_queue = create_job_queue(app, db)
+
+    # Serialized user JSON reused across list responses (PAYLOAD_CACHE_SIZE=0 disables)
+    payload_cache = create_payload_cache(app.config)
+
+    # Username/email prefix and name full-text search (SQLite FTS5 when available)
+    user_search = create_user_search(app, db, User, shard_router)
+
+    auth_bp, user_bp = create_routes(db, User, user_cache, profile_versions, login_throttle, payload_cache,
+                                     login_activity, job_queue, user_search, shard_router)
+
+    # Register blueprints
+    app.register_blueprint(auth_bp, url_prefix='/auth')
+    app.register_blueprint(user_bp, url_prefix='/users')
+
+    # Prometheus metrics at /metrics, summed across pre-forked workers through METRICS_DIR
+    shared_metrics = init_metrics(app, db)
+
+    # SQL profiler and slow-request log (QUERY_PROFILING=true enables)
+    init_profiling(app, db)
+
+    # Gzip large JSON responses for clients that accept it (RESPONSE_COMPRESSION=false disables)
+    init_compression(app)
+
+    # Register `flask users ...` commands
+    app.cli.add_command(create_cli(db, User))
+
+    # Landing page prebuilt at startup, CSS/JS as hashed immutable assets (FRONTEND_PRECOMPILE=false disables)
+    init_frontend(app)
+
+    @app.route('/api')
+    def api_info():
+        """API information endpoint"""
+        return jsonify({
+            'message': 'Flask Application API',
+            'version': '1.0.0',
+            'endpoints': {
+                'auth': '/auth',
+                'users': '/users'
+            }
+        })
+
+    # Cached SELECT 1 probe shared by /health and /health/ready
+    readiness = ReadinessProbe(
+        db,
+        ttl=app.config['HEALTH_CHECK_TTL'],
+        max_latency_ms=app.config['READY_MAX_DB_LATENCY_MS'],
+        max_saturation=app.config['READY_MAX_POOL_SATURATION']
+    )
+
+    @app.route('/health/live')
+    def liveness_check():
+        """Liveness probe: the process is up and serving requests"""
+        return jsonify({'status': 'alive'})
+
+    @app.route('/health/ready')
+    def readiness_check():
+        """Readiness probe: the database answers quickly and the pool has headroom"""
+        report = readiness.check()
+        return jsonify(report), 200 if report['ready'] else 503
+
+    @app.route('/health')
+    def health_check():
+        """Health check endpoint"""
+        return jsonify({
+            'status': 'healthy',
+            'database': readiness.check()['database'],
+            'startup': app.extensions['startup'],
+            'password_pool': password_pool.stats() if password_pool else None,
+            'user_cache': user_cache.stats() if user_cache else None,
+            'login_throttle': login_throttle.stats() if login_throttle else None,
+            'payload_cache': payload_cache.stats() if payload_cache else None,
+            'login_activity': login_activity.stats() if login_activity else None,
+            'jobs': job_queue.stats(),
+            'replica': replica_router.stats() if replica_router else None,
+            'shards': shard_router.stats() if shard_router else None
+        })
+
+    @app.errorhandler(404)
+    def not_found(error):
+        """404 error handler"""
+        return jsonify({'error': 'Resource not found'}), 404
+
+    @app.errorhandler(PasswordPoolFull)
+    def password_pool_full(error):
+        """503 handler for rejected password hashing work"""
+        db.session.rollback()
+        response = jsonify({'error': 'Server is busy, please retry later'})
+        response.headers['Retry-After'] = str(error.retry_after)
+        return response, 503
+
+    @app.errorhandler(LoginThrottled)
+    def login_throttled(error):
+        """429 handler for rate-limited login attempts"""
+        response = jsonify({'error': 'Too many login attempts, please retry later'})
+        response.headers['Retry-After'] = str(error.retry_after)
+        return response, 429
+
+    @app.errorhandler(500)
+    def internal_error(error):
+        """500 error handler"""
+        db.session.rollback()
+        return jsonify({'error': 'Internal server error'}), 500
+
+    # Create tables unless the stored schema stamp already matches the models;
+    # tables from before the lookup columns get them added and backfilled
+    schema = 'skipped'
+    if app.config['SCHEMA_AUTO_CREATE']:
+        with app.app_context():
+            schema = ensure_schema(db, upgrades=[lambda engine: add_lookup_columns(engine, User.__table__)])
+            if schema == 'incomplete':
+                logger.warning('Schema is incomplete; run `flask users normalize` to list case-insensitive '
+                               'duplicate usernames or emails, resolve them and restart')
+            if shard_router is not None:
+                shard_router.ensure_schema()
+            user_search.ensure_index()
+
+    # Buffers to flush before exit; forked workers call close_app() themselves
+    app.extensions['shutdown_hooks'] = (([shared_metrics.close] if shared_metrics else []) + [job_queue.close]
+                                        + ([login_activity.close] if login_activity else []))
+    atexit.register(close_app, app)
+
+    app.extensions['user_model'] = User
+    app.extensions['startup'] = {
+        'import_ms': round((imported - started) * 1000, 3),
+        'startup_ms': round((time.perf_counter() - started) * 1000, 3),
+        'schema': schema
+    }
+    logger.info('App created in %(startup_ms)sms (imports %(import_ms)sms, schema %(schema)s)', app.extensions['startup'])
+    return app
+
+
+def close_app(app):
+    """Flush write-behind buffers and stop background work; safe to call more than once"""
+    hooks = app.extensions.get('shutdown_hooks', [])
+    while hooks:
+        hooks.pop()()
+
 
 if __name__ == '__main__':
-    # Create database tables
-    with app.app_context():
-        db.create_all()
-    
+    app = create_app()
+
     # Run the application
     app.run(
         host='0.0.0.0',
         port=int(os.getenv('PORT', 5000)),
         debug=os.getenv('FLASK_ENV') == 'development'
-    )
\ No newline at end of file
+    )
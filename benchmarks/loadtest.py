@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Load Test
+Drives the API with concurrent clients and reports latency percentiles and
+throughput as JSON. Runs either in-process (Flask test client) or against a
+local multi-process server that the tool starts on a temporary database.
+
+Usage:
+    python benchmarks/loadtest.py --scenario login-heavy --clients 16 --duration 20
+    python benchmarks/loadtest.py --mode server --workers 4 --output run.json
+    python benchmarks/loadtest.py --baseline run.json --max-regression 0.2
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'SecurePass123'
+
+# Operation weights per scenario
+SCENARIOS = {
+    'register-heavy': {'register': 70, 'login': 10, 'profile': 15, 'list': 5},
+    'login-heavy': {'register': 5, 'login': 70, 'profile': 20, 'list': 5},
+    'profile-heavy': {'register': 2, 'login': 8, 'profile': 80, 'list': 10},
+    'mixed': {'register': 20, 'login': 30, 'profile': 40, 'list': 10},
+}
+
+
+class InProcessClient:
+    """Calls the app through Flask's test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = self.client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_data()
+
+    def close(self):
+        pass
+
+
+class HttpClient:
+    """Calls a running server over a keep-alive HTTP connection"""
+
+    def __init__(self, host, port):
+        self.connection = http.client.HTTPConnection(host, port, timeout=30)
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        payload = json.dumps(body) if body is not None else None
+        try:
+            self.connection.request(method, path, body=payload, headers=headers)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            return 0, b''
+
+    def close(self):
+        self.connection.close()
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    """Build latency and throughput stats from (operation, seconds, status) samples"""
+    def stats(entries):
+        latencies = sorted(seconds * 1000 for _, seconds, _ in entries)
+        statuses = {}
+        for _, _, status in entries:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {
+            'requests': len(entries),
+            'rps': round(len(entries) / elapsed, 2) if elapsed else 0.0,
+            'p50_ms': round(percentile(latencies, 0.50) or 0, 3),
+            'p95_ms': round(percentile(latencies, 0.95) or 0, 3),
+            'p99_ms': round(percentile(latencies, 0.99) or 0, 3),
+            'max_ms': round(latencies[-1], 3) if latencies else 0.0,
+            'errors': sum(1 for _, _, status in entries if status == 0 or status >= 500),
+            'statuses': statuses
+        }
+
+    operations = sorted({operation for operation, _, _ in samples})
+    return {
+        'overall': stats(samples),
+        'operations': {op: stats([s for s in samples if s[0] == op]) for op in operations}
+    }
+
+
+def seed_users(client, count, tag):
+    """Register one user, bulk-register the rest, and return (usernames, token)"""
+    first = f'{tag}_seed0'
+    status, body = client.request('POST', '/auth/register', {
+        'username': first, 'email': f'{first}@example.com', 'password': PASSWORD
+    })
+    if status != 201:
+        raise SystemExit(f'Seeding failed with status {status}: {body[:200]!r}')
+    token = json.loads(body)['access_token']
+
+    usernames = [first] + [f'{tag}_seed{i}' for i in range(1, count)]
+    if count > 1:
+        users = [{'username': name, 'email': f'{name}@example.com', 'password': PASSWORD} for name in usernames[1:]]
+        status, body = client.request('POST', '/auth/register/batch', {'users': users}, token=token)
+        if status != 200:
+            raise SystemExit(f'Batch seeding failed with status {status}: {body[:200]!r}')
+    return usernames, token
+
+
+def run_clients(make_client, options, usernames, token, tag):
+    """Run concurrent clients for the configured duration and return samples"""
+    weights = SCENARIOS[options.scenario]
+    operations, operation_weights = list(weights), list(weights.values())
+    deadline = time.perf_counter() + options.duration
+    results = []
+    lock = threading.Lock()
+
+    def worker(number):
+        rng = random.Random(options.seed + number)
+        client = make_client()
+        samples = []
+        sequence = 0
+        try:
+            while time.perf_counter() < deadline:
+                if options.requests and len(samples) >= options.requests:
+                    break
+                operation = rng.choices(operations, operation_weights)[0]
+                if operation == 'register':
+                    sequence += 1
+                    name = f'{tag}_c{number}_{sequence}'
+                    request = ('POST', '/auth/register', {'username': name, 'email': f'{name}@example.com', 'password': PASSWORD}, None)
+                elif operation == 'login':
+                    request = ('POST', '/auth/login', {'username': rng.choice(usernames), 'password': PASSWORD}, None)
+                elif operation == 'profile':
+                    request = ('GET', '/auth/profile', None, token)
+                else:
+                    request = ('GET', '/users/?limit=50', None, token)
+
+                started = time.perf_counter()
+                status, _ = client.request(*request)
+                samples.append((operation, time.perf_counter() - started, status))
+        finally:
+            client.close()
+            with lock:
+                results.extend(samples)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(options.clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def prepare_environment(options, database_path):
+    """Environment for the app under test: temporary DB, throttling optional"""
+    env = dict(os.environ)
+    env['DATABASE_URL'] = f'sqlite:///{database_path}'
+    env['BCRYPT_ROUNDS'] = str(options.bcrypt_rounds)
+    if not options.keep_throttle:
+        env['LOGIN_THROTTLE'] = 'false'
+    return env
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(options, env):
+    """Start run.py in multi-process mode and wait until it is live"""
+    port = options.port or free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'run.py'), '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(options.workers), '--threads', str(options.threads)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/health/live', timeout=1):
+                return process, port
+        except OSError:
+            if process.poll() is not None:
+                raise SystemExit('Server exited during startup')
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit('Server did not become live within 30s')
+
+
+def compare(report, baseline_path, max_regression):
+    """Return regressions of throughput or p95 latency beyond max_regression"""
+    with open(baseline_path) as handle:
+        baseline = json.load(handle)
+    regressions = []
+    for name, current in [('overall', report['overall'])] + list(report['operations'].items()):
+        previous = baseline['overall'] if name == 'overall' else baseline['operations'].get(name)
+        if not previous:
+            continue
+        if previous['rps'] and current['rps'] < previous['rps'] * (1 - max_regression):
+            regressions.append(f"{name}: rps {previous['rps']} -> {current['rps']}")
+        if previous['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['inprocess', 'server'], default='inprocess')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='mixed')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run')
+    parser.add_argument('--requests', type=int, default=0, help='Stop each client after this many requests')
+    parser.add_argument('--users', type=int, default=50, help='Users seeded before the run')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--keep-throttle', action='store_true', help='Leave login throttling enabled')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Server mode worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='Server mode threads per worker')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--baseline', help='Fail if this run regresses against a previous report')
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    options = parser.parse_args()
+
+    tag = f'lt{int(time.time())}'
+    env = prepare_environment(options, os.path.join(tempfile.mkdtemp(), 'loadtest.db'))
+    process = None
+
+    if options.mode == 'inprocess':
+        os.environ.update(env)
+        sys.path.insert(0, ROOT)
+        from app import create_app
+        app = create_app()
+        make_client = lambda: InProcessClient(app)
+    else:
+        process, port = start_server(options, env)
+        make_client = lambda: HttpClient('127.0.0.1', port)
+
+    try:
+        setup_client = make_client()
+        usernames, token = seed_users(setup_client, options.users, tag)
+        setup_client.close()
+        samples, elapsed = run_clients(make_client, options, usernames, token, tag)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    report = {
+        'mode': options.mode,
+        'scenario': options.scenario,
+        'clients': options.clients,
+        'duration_s': round(elapsed, 3),
+        'bcrypt_rounds': options.bcrypt_rounds,
+    }
+    report.update(summarize(samples, elapsed))
+
+    output = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w') as handle:
+            handle.write(output + '\n')
+    print(output)
+
+    if options.baseline:
+        regressions = compare(report, options.baseline, options.max_regression)
+        if regressions:
+            print('Regressions:\n  ' + '\n  '.join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
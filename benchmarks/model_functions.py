@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Model Microbenchmarks
+Per-call cost of the User model hot path: password hashing and checking,
+the validators, to_dict and construction. String inputs are generated at
+each of the requested sizes; bcrypt runs at the requested cost.
+
+Usage:
+    python benchmarks/model_functions.py --sizes 8,64,512 --output baseline.json
+    python benchmarks/model_functions.py --baseline baseline.json --threshold 0.25
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_cases(User, sizes, rounds):
+    """Return [(name, callable)] for every benchmarked function and input size"""
+    password = 'SecurePass123'
+    user = User('benchuser', 'bench@example.com', password)
+    cases = [
+        (f'hash_password[rounds={rounds}]', lambda: user._hash_password(password)),
+        (f'verify_password[rounds={rounds}]', lambda: user.verify_password(password)),
+    ]
+
+    for size in sizes:
+        email = 'a' * size + '@example.com'
+        # Lowercase run first so the uppercase and digit searches scan the whole string
+        strong_password = 'a' * max(size - 2, 1) + 'A1'
+        username = 'u' * size
+        name = 'n' * size
+        sized_user = User(username, email, password_hash=user.password_hash, first_name=name, last_name=name)
+        cases += [
+            (f'validate_email[{size}]', lambda email=email: User.validate_email(email)),
+            (f'validate_password[{size}]', lambda value=strong_password: User.validate_password(value)),
+            (f'validate_username[{size}]', lambda value=username: User.validate_username(value)),
+            (f'to_dict[{size}]', sized_user.to_dict),
+            (f'construct[{size}]', lambda username=username, email=email, name=name: User(
+                username, email, password_hash=user.password_hash, first_name=name, last_name=name)),
+        ]
+    return cases
+
+
+def measure(fn, repeats):
+    """Best-of-repeats nanoseconds per call, with the loop count picked by timeit"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeats, number=number))
+    return {'ns_per_call': round(best / number * 1e9, 1), 'calls': number}
+
+
+def compare(results, baseline_path, threshold):
+    """Return functions slower than the baseline by more than threshold"""
+    with open(baseline_path) as handle:
+        baseline = json.load(handle)['results']
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous and result['ns_per_call'] > previous['ns_per_call'] * (1 + threshold):
+            change = result['ns_per_call'] / previous['ns_per_call'] - 1
+            regressions.append(f"{name}: {previous['ns_per_call']}ns -> {result['ns_per_call']}ns (+{change:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='8,64,512', help='Comma-separated string input lengths')
+    parser.add_argument('--bcrypt-rounds', type=int, default=4)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--filter', help='Only run functions whose name contains this text')
+    parser.add_argument('--output', help='Write the JSON results (usable as a baseline) to this file')
+    parser.add_argument('--baseline', help='Fail if any function is slower than in this file')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed slowdown, 0.25 = 25%%')
+    args = parser.parse_args()
+
+    # Hash inline so the numbers are the function's own cost, not pool dispatch
+    sys.path.insert(0, ROOT)
+    from app import create_app
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'),
+        'BCRYPT_ROUNDS': args.bcrypt_rounds,
+        'PASSWORD_POOL_WORKERS': 0
+    })
+    User = app.extensions['user_model']
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    results = {}
+    for name, fn in build_cases(User, sizes, args.bcrypt_rounds):
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(fn, args.repeats)
+
+    output = json.dumps({'sizes': sizes, 'bcrypt_rounds': args.bcrypt_rounds, 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    print(output)
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.threshold)
+        if regressions:
+            print('Regressions:\n  ' + '\n  '.join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Serialization Benchmark
+Compares building a /users/ page body with the default JSON provider,
+the orjson provider, and the per-user payload cache.
+
+Usage: python benchmarks/serialization.py [--users 1000] [--rounds 20]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Add project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+from flask.json.provider import DefaultJSONProvider
+from app import create_app
+from serialization import OrjsonProvider, PayloadCache, orjson, user_fragment
+
+app = create_app()
+db = app.extensions['sqlalchemy']
+User = app.extensions['user_model']
+
+# Any valid bcrypt hash will do; the benchmark never verifies passwords
+PASSWORD_HASH = '$2b$04$abcdefghijklmnopqrstuuabcdefghijklmnopqrstuvwxyz12345'
+
+
+def seed(count):
+    """Insert count users without paying for bcrypt"""
+    db.session.query(User).delete()
+    db.session.add_all([
+        User(f'user{i}', f'user{i}@example.com', password_hash=PASSWORD_HASH, first_name='First', last_name='Last')
+        for i in range(count)
+    ])
+    db.session.commit()
+    return User.query.order_by(User.id).all()
+
+
+def run(name, users, rounds, render, repeats=3):
+    """Time render(users), best of several repeats, and return users serialized per second"""
+    render(users)
+    elapsed = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            render(users)
+        elapsed = min(elapsed, time.perf_counter() - started)
+    return {'name': name, 'seconds': round(elapsed, 4), 'users_per_second': round(len(users) * rounds / elapsed)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    with app.app_context():
+        users = seed(args.users)
+        results = []
+
+        app.json = DefaultJSONProvider(app)
+        results.append(run('default', users, args.rounds,
+                           lambda page: app.json.dumps({'users': [user.to_dict() for user in page]})))
+
+        if orjson is not None:
+            app.json = OrjsonProvider(app)
+            results.append(run('orjson', users, args.rounds,
+                               lambda page: app.json.dumps({'users': [user.to_dict() for user in page]})))
+
+        payload_cache = PayloadCache(maxsize=args.users)
+        results.append(run('payload_cache', users, args.rounds,
+                           lambda page: '{"users":[%s]}' % ','.join(user_fragment(user, payload_cache) for user in page)))
+
+    baseline = results[0]['users_per_second']
+    for result in results:
+        result['speedup'] = round(result['users_per_second'] / baseline, 2)
+    print(json.dumps({'users': args.users, 'rounds': args.rounds, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
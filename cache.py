@@ -0,0 +1,161 @@
+"""
+User Cache
+In-process LRU cache with TTL for user records, invalidated on writes.
+Invalidations reach every worker of a pre-fork server through counters in
+shared memory that the workers inherit from the master.
+"""
+
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+
+
+class SharedGenerations:
+    """
+    Per-slot invalidation counters in shared memory. Made before run.py forks
+    its workers, so a bump in one worker is seen by all. A cached entry keeps
+    the counter of its key's slot and is stale once that counter moves.
+    """
+
+    def __init__(self, slots=65536):
+        self.slots = slots
+        self._counters = multiprocessing.RawArray('Q', slots)
+        self._lock = multiprocessing.Lock()
+
+    def current(self, key):
+        return self._counters[hash(key) % self.slots]
+
+    def bump(self, key):
+        slot = hash(key) % self.slots
+        with self._lock:
+            self._counters[slot] += 1
+
+
+_generations = None
+
+
+def shared_generations():
+    """The process-wide counters, created on first use (before workers fork)"""
+    global _generations
+    if _generations is None:
+        _generations = SharedGenerations()
+    return _generations
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache whose entries also expire after ttl seconds. With
+    generations, invalidate() also drops the entry in every other worker.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60, generations=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generations = generations
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value, or None if missing or expired"""
+        now = time.monotonic()
+        generation = self.generations.current(key) if self.generations is not None else None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now or entry[2] != generation:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, generation=None):
+        """
+        Store a value, evicting the least recently used entry if full.
+        generation is the key's counter read before the value was loaded.
+        """
+        if generation is None and self.generations is not None:
+            generation = self.generations.current(key)
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value, generation)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """Return the cached value or call loader(); None results are not cached"""
+        value = self.get(key)
+        if value is None:
+            # Read first: a write landing during the load leaves the entry already stale
+            generation = self.generations.current(key) if self.generations is not None else None
+            value = loader()
+            if value is not None:
+                self.set(key, value, generation)
+        return value
+
+    def invalidate(self, key):
+        """Drop a single entry, in every worker when generations are shared"""
+        if self.generations is not None:
+            self.generations.bump(key)
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Return size and hit/miss counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+def create_user_cache(config):
+    """Create the user cache from app config, or None when USER_CACHE_SIZE is 0"""
+    maxsize = config.get('USER_CACHE_SIZE', 10000)
+    if not maxsize:
+        return None
+    return LRUCache(maxsize=maxsize, ttl=config.get('USER_CACHE_TTL', 60), generations=shared_generations())
+
+
+def bind_user_cache(db, User, cache):
+    """
+    Invalidate cached users whenever a row is updated or deleted.
+    Entries are dropped at flush time and again after commit, so a reader
+    that refilled the cache from the old row in between cannot keep it.
+    """
+    # The user cache and the profile versions can both be bound to one session
+    pending_key = ('user_cache_invalidations', id(cache))
+
+    def track(mapper, connection, target):
+        cache.invalidate(target.id)
+        db.session.info.setdefault(pending_key, set()).add(target.id)
+
+    def flush_invalidations(session):
+        for user_id in session.info.pop(pending_key, ()):
+            cache.invalidate(user_id)
+
+    def discard_invalidations(session):
+        session.info.pop(pending_key, None)
+
+    event.listen(User, 'after_update', track)
+    event.listen(User, 'after_delete', track)
+    event.listen(db.session, 'after_commit', flush_invalidations)
+    event.listen(db.session, 'after_rollback', discard_invalidations)
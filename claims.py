@@ -0,0 +1,89 @@
+"""
+Profile Claims
+Embeds a versioned snapshot of a user's public profile in the access token
+so that /auth/profile can answer without touching the database. The
+snapshot is only trusted while it is as new as the user's updated_at, kept
+in a version cache that every worker invalidates on writes and that reads
+the database only on a miss.
+"""
+
+from datetime import datetime
+from sqlalchemy import select
+from cache import LRUCache, bind_user_cache, shared_generations
+
+PROFILE_CLAIM = 'profile'
+PROFILE_CLAIM_SCHEMA = 1
+
+# Version recorded for deleted users, newer than any snapshot
+DELETED = datetime.max
+
+
+def profile_claims(user):
+    """Build the additional JWT claims carrying the user's profile snapshot"""
+    return {
+        PROFILE_CLAIM: {
+            'schema': PROFILE_CLAIM_SCHEMA,
+            'version': user.updated_at.isoformat() if user.updated_at else None,
+            'user': user.to_dict()
+        }
+    }
+
+
+def read_profile_claims(claims, versions):
+    """
+    Return the profile snapshot from decoded JWT claims, or None when the
+    token has no usable snapshot or the user was updated or deleted since.
+    """
+    snapshot = claims.get(PROFILE_CLAIM)
+    if not isinstance(snapshot, dict) or snapshot.get('schema') != PROFILE_CLAIM_SCHEMA:
+        return None
+    try:
+        version = datetime.fromisoformat(snapshot['version'])
+        user = snapshot['user']
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    latest = versions.get(user.get('id'))
+    if latest is not None and version < latest:
+        return None
+    return user
+
+
+class ProfileVersions:
+    """Cached updated_at of each user, loaded from the users table on a miss"""
+
+    def __init__(self, db, User, cache):
+        self.db = db
+        self.User = User
+        self.cache = cache
+
+    def get(self, user_id):
+        """The user's updated_at, or DELETED when the user no longer exists"""
+        if user_id is None:
+            return None
+        # Deleted users are not cached, so a reused id is looked up again
+        return self.cache.get_or_load(int(user_id), lambda: self._load(user_id)) or DELETED
+
+    def _load(self, user_id):
+        row = self.db.session.execute(
+            select(self.User.updated_at).where(self.User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        return row[0] or datetime.min
+
+
+def create_profile_versions(config, db, User):
+    """
+    Create the version lookup for profile snapshots when PROFILE_CLAIMS is on.
+    Its entries are invalidated like the user cache's, in every worker.
+    """
+    if not config.get('PROFILE_CLAIMS'):
+        return None
+    cache = LRUCache(
+        maxsize=config.get('PROFILE_VERSIONS_SIZE', 100000),
+        ttl=config.get('USER_CACHE_TTL', 60),
+        generations=shared_generations()
+    )
+    bind_user_cache(db, User, cache)
+    return ProfileVersions(db, User, cache)
@@ -0,0 +1,301 @@
+"""
+Command Line Tools
+Streaming bulk export and import of the users table:
+
+    flask users export --format jsonl --output users.jsonl
+    flask users import users.jsonl --checkpoint users.ckpt
+    flask users sync-replica
+    flask users rebuild-search
+    flask users rebalance --dry-run
+"""
+
+import csv
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import select
+
+from hashing import DEFAULT_BCRYPT_ROUNDS, hash_password
+from models import add_lookup_columns, lookup_duplicates
+from replica import REPLICA_BIND
+from search import ensure_search_index, rebuild_search_index
+from sharding import DIRECTORY
+
+EXPORT_COLUMNS = [
+    'id', 'username', 'email', 'password_hash', 'first_name', 'last_name',
+    'is_active', 'created_at', 'updated_at', 'last_login_at', 'last_login_ip',
+    'login_count', 'failed_login_count'
+]
+DATETIME_COLUMNS = ('created_at', 'updated_at', 'last_login_at')
+INTEGER_COLUMNS = ('id', 'login_count', 'failed_login_count')
+
+
+def serialize_row(row):
+    """Convert a users row mapping to plain JSON-compatible values"""
+    record = dict(row)
+    for column in DATETIME_COLUMNS:
+        if record.get(column) is not None:
+            record[column] = record[column].isoformat()
+    return record
+
+
+def parse_record(record):
+    """Convert an imported record to column values, keeping any plaintext password aside"""
+    values = {}
+    for column in EXPORT_COLUMNS:
+        value = record.get(column)
+        if value in (None, ''):
+            continue
+        if column in INTEGER_COLUMNS:
+            value = int(value)
+        elif column == 'is_active':
+            value = value if isinstance(value, bool) else str(value).lower() in ('1', 'true', 'yes')
+        elif column in DATETIME_COLUMNS:
+            value = datetime.fromisoformat(value)
+        elif column == 'email':
+            value = value.strip().lower()
+        elif column == 'username':
+            value = value.strip()
+        values[column] = value
+    values['username_lower'] = values.get('username', '').lower()
+    values['email_lower'] = values.get('email', '').lower()
+    values.setdefault('first_name', None)
+    values.setdefault('last_name', None)
+    values.setdefault('is_active', True)
+    values.setdefault('last_login_at', None)
+    values.setdefault('last_login_ip', None)
+    values.setdefault('login_count', 0)
+    values.setdefault('failed_login_count', 0)
+    now = datetime.utcnow()
+    values.setdefault('created_at', now)
+    values.setdefault('updated_at', values['created_at'])
+    return values, record.get('password')
+
+
+def read_records(stream, fmt):
+    """Yield records one at a time from a JSONL or CSV stream"""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_checkpoint(path):
+    """Return the number of records already imported according to the checkpoint"""
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as handle:
+        return int(handle.read().strip() or 0)
+
+
+def write_checkpoint(path, count):
+    """Atomically record how many records have been imported"""
+    if not path:
+        return
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as handle:
+        handle.write(str(count))
+    os.replace(tmp_path, path)
+
+
+def create_cli(db, User):
+    """Create the `flask users` command group"""
+    users_cli = AppGroup('users', help='Bulk import and export of users.')
+    table = User.__table__
+
+    def shard_router():
+        return current_app.extensions.get('shard_router')
+
+    def require_unsharded(command):
+        if shard_router() is not None:
+            raise click.ClickException(
+                f'{command} works on the primary users table only; run it before enabling '
+                f'SHARD_DATABASE_URLS, then move the users with `flask users rebalance --include-primary`'
+            )
+
+    @users_cli.command('export')
+    @click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv']), default='jsonl')
+    @click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help='Output file (default stdout).')
+    @click.option('--batch-size', type=int, default=1000, help='Rows fetched per round trip.')
+    def export_users(fmt, output, batch_size):
+        """Stream every user, including password hashes, with constant memory"""
+        columns = [table.c[name] for name in EXPORT_COLUMNS]
+        statement = select(*columns).order_by(table.c.id).execution_options(
+            stream_results=True,
+            yield_per=batch_size
+        )
+
+        writer = None
+        if fmt == 'csv':
+            writer = csv.DictWriter(output, fieldnames=EXPORT_COLUMNS)
+            writer.writeheader()
+
+        # Sharded tables are exported shard by shard, each in id order
+        router = shard_router()
+        shards = router.read_shards() if router is not None else [None]
+        rows = (
+            row
+            for shard in shards
+            for row in db.session.execute(
+                statement, bind_arguments={'shard_id': shard} if shard else None
+            ).mappings()
+        )
+
+        count = 0
+        for row in rows:
+            record = serialize_row(row)
+            if writer:
+                writer.writerow(record)
+            else:
+                output.write(json.dumps(record, ensure_ascii=False) + '\n')
+            count += 1
+
+        click.echo(f'Exported {count} users', err=True)
+
+    @users_cli.command('normalize')
+    def normalize_users():
+        """Add, backfill and index the lowercase lookup columns on an existing table"""
+        require_unsharded('normalize')
+        add_lookup_columns(db.engine, table)
+
+        with db.engine.connect() as connection:
+            duplicates = lookup_duplicates(connection, table)
+        if duplicates:
+            for name, groups in duplicates.items():
+                for value, usernames in groups.items():
+                    click.echo(f'{name} {value!r} is shared by: {", ".join(usernames)}', err=True)
+            raise click.ClickException(
+                'Rename or delete all but one user of each group above, then run normalize again '
+                'to create the unique lookup indexes'
+            )
+
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+        click.echo('Lookup columns are up to date', err=True)
+
+    @users_cli.command('import')
+    @click.argument('source', type=click.File('r', encoding='utf-8'))
+    @click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv']), default='jsonl')
+    @click.option('--chunk-size', type=int, default=1000, help='Rows inserted per transaction.')
+    @click.option('--checkpoint', type=click.Path(dir_okay=False), default=None, help='File used to resume an interrupted import.')
+    @click.option('--workers', type=int, default=os.cpu_count() or 1, help='Processes used to hash plaintext passwords.')
+    def import_users(source, fmt, chunk_size, checkpoint, workers):
+        """
+        Insert users in chunked executemany batches. Records carry either a
+        password_hash or a plaintext password, which is hashed in a process pool.
+        """
+        require_unsharded('import')
+        rounds = current_app.config.get('BCRYPT_ROUNDS', DEFAULT_BCRYPT_ROUNDS)
+        done = read_checkpoint(checkpoint)
+        if done:
+            click.echo(f'Resuming after {done} records', err=True)
+
+        imported = done
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunk = []
+            for position, record in enumerate(read_records(source, fmt)):
+                if position < done:
+                    continue
+                chunk.append(record)
+                if len(chunk) >= chunk_size:
+                    imported = insert_chunk(chunk, imported, executor, rounds, checkpoint)
+                    chunk = []
+            if chunk:
+                imported = insert_chunk(chunk, imported, executor, rounds, checkpoint)
+
+        click.echo(f'Imported {imported - done} users ({imported} total)', err=True)
+
+    def insert_chunk(records, imported, executor, rounds, checkpoint):
+        """Hash plaintext passwords, insert the chunk and advance the checkpoint"""
+        rows = []
+        plaintext = []
+        for record in records:
+            values, password = parse_record(record)
+            if 'password_hash' not in values:
+                if not password:
+                    raise click.ClickException(f'Record {imported + len(rows)} has neither password nor password_hash')
+                plaintext.append((len(rows), password))
+            rows.append(values)
+
+        if plaintext:
+            hashes = executor.map(hash_password, [password for _, password in plaintext], [rounds] * len(plaintext), chunksize=64)
+            for (index, _), password_hash in zip(plaintext, hashes):
+                rows[index]['password_hash'] = password_hash
+
+        # executemany needs a uniform key set; rows without an id get one assigned
+        with_ids = [row for row in rows if 'id' in row]
+        without_ids = [row for row in rows if 'id' not in row]
+
+        try:
+            for group in (with_ids, without_ids):
+                if group:
+                    db.session.execute(table.insert(), group)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise click.ClickException(f'Chunk starting at record {imported} failed: {getattr(e, "orig", e)}')
+
+        imported += len(rows)
+        write_checkpoint(checkpoint, imported)
+        click.echo(f'Imported {imported} records', err=True)
+        return imported
+
+    @users_cli.command('sync-replica')
+    def sync_replica():
+        """Copy a SQLite primary onto the SQLite replica bind, for local replica testing"""
+        replica = db.engines.get(REPLICA_BIND)
+        if replica is None:
+            raise click.ClickException('REPLICA_DATABASE_URL is not set')
+        if db.engine.dialect.name != 'sqlite' or replica.dialect.name != 'sqlite':
+            raise click.ClickException('Only SQLite files can be synced; use the database\'s own replication')
+
+        source = db.engine.raw_connection()
+        target = replica.raw_connection()
+        try:
+            if not isinstance(source.driver_connection, sqlite3.Connection):
+                raise click.ClickException('Unsupported SQLite driver')
+            source.driver_connection.backup(target.driver_connection)
+        finally:
+            target.close()
+            source.close()
+        click.echo(f'Copied {db.engine.url.database} to {replica.url.database}', err=True)
+
+    @users_cli.command('rebuild-search')
+    def rebuild_search():
+        """Create the user search index if missing and re-index every user"""
+        router = shard_router()
+        engines = router.engines().values() if router is not None else [db.engine]
+        for engine in engines:
+            if not ensure_search_index(engine):
+                raise click.ClickException('The search index needs SQLite with FTS5')
+            rebuild_search_index(engine)
+        click.echo('Search index rebuilt', err=True)
+
+    @users_cli.command('rebalance')
+    @click.option('--batch-size', type=int, default=500, help='Users read per round trip.')
+    @click.option('--dry-run', is_flag=True, help='Only count the users that would move.')
+    @click.option('--include-primary', is_flag=True, help='Also move users left in the primary from before sharding.')
+    def rebalance(batch_size, dry_run, include_primary):
+        """
+        Move users to the shard their username hashes to, e.g. after adding
+        a shard. Run with SHARD_REBALANCING=true on the app servers meanwhile.
+        """
+        router = shard_router()
+        if router is None:
+            raise click.ClickException('SHARD_DATABASE_URLS is not set')
+        moved = router.rebalance(batch_size=batch_size, dry_run=dry_run, include_primary=include_primary)
+        for (source, target), count in sorted(moved.items()):
+            source = 'primary' if source == DIRECTORY else source
+            click.echo(f'{source} -> {target}: {count}', err=True)
+        total = sum(moved.values())
+        click.echo(f'{"Would move" if dry_run else "Moved"} {total} users', err=True)
+
+    return users_cli
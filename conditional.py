@@ -0,0 +1,101 @@
+"""
+Conditional Requests
+Strong ETags for user payloads, so a client polling an unchanged resource
+gets 304 Not Modified before any JSON is built, and gzip for large JSON
+responses.
+"""
+
+import gzip
+import hashlib
+import zlib
+from flask import current_app, request
+
+# Appended to the ETag of gzipped responses: a strong ETag names exact bytes
+GZIP_SUFFIX = '-gzip'
+
+
+def make_etag(*parts):
+    """Hash the values a representation is derived from into an opaque tag"""
+    return hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=12).hexdigest()
+
+
+def user_etag(user):
+    """ETag of a user's to_dict(); every write bumps updated_at"""
+    return make_etag('user', user['id'], user['updated_at'])
+
+
+def collection_etag(count, max_id, max_updated_at, after_id=0, limit=None, stream=False):
+    """
+    ETag of a list of users from its row count, highest id and latest
+    updated_at, plus the cursor, page size and format that shape the body.
+    """
+    return make_etag('users', count, max_id, str(max_updated_at), after_id, None if stream else limit, stream)
+
+
+def tag_response(response, etag):
+    """Set the ETag and make clients revalidate before reusing the response"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified(etag):
+    """Return a 304 response if the client's If-None-Match already holds etag, else None"""
+    if_none_match = request.if_none_match
+    if not if_none_match:
+        return None
+    for candidate in (etag, etag + GZIP_SUFFIX):
+        if if_none_match.contains(candidate):
+            return tag_response(current_app.response_class(status=304), candidate)
+    return None
+
+
+def _gzip_stream(chunks, level):
+    """Gzip a streamed body chunk by chunk"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress_response(response, min_size=1024, level=6):
+    """Gzip a successful JSON response when the client accepts it and it is large enough"""
+    if (response.status_code != 200 or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers or response.direct_passthrough):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']:
+        return response
+
+    if response.is_streamed:
+        response.response = _gzip_stream(response.response, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(gzip.compress(data, compresslevel=level))
+
+    response.headers['Content-Encoding'] = 'gzip'
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(etag + GZIP_SUFFIX, weak)
+    return response
+
+
+def init_compression(app):
+    """Gzip large JSON responses (RESPONSE_COMPRESSION=false disables)"""
+    if not app.config.get('RESPONSE_COMPRESSION', True):
+        return
+
+    min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+    level = app.config.get('COMPRESS_LEVEL', 6)
+
+    @app.after_request
+    def compress(response):
+        return compress_response(response, min_size, level)
@@ -0,0 +1,182 @@
+"""
+Database Engine Profile
+Connection-level tuning for SQLite, pool settings for server databases and
+a schema-version stamp that lets startup skip create_all().
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+from sqlalchemy import Column, MetaData, String, Table, event, inspect, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.schema import CreateColumn
+
+logger = logging.getLogger(__name__)
+
+# One-row table holding the fingerprint of the models create_all() last ran with
+schema_version = Table('schema_version', MetaData(), Column('version', String(64), nullable=False))
+
+# (database URL, fingerprint) pairs already checked in this process
+_checked_schemas = set()
+
+
+class SchemaMismatch(Exception):
+    """Raised when an existing table lacks columns that cannot be added automatically"""
+
+
+def engine_options_from_env(database_uri):
+    """Build SQLALCHEMY_ENGINE_OPTIONS from DB_POOL_* environment variables"""
+    options = {}
+    if database_uri.startswith('sqlite'):
+        return options
+
+    options['pool_pre_ping'] = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    options['pool_recycle'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    for name, key in (('DB_POOL_SIZE', 'pool_size'),
+                      ('DB_MAX_OVERFLOW', 'max_overflow'),
+                      ('DB_POOL_TIMEOUT', 'pool_timeout')):
+        if os.getenv(name):
+            options[key] = int(os.getenv(name))
+    return options
+
+
+def sqlite_pragmas_from_config(config):
+    """Return the PRAGMA statements to run on every new SQLite connection"""
+    if not config.get('SQLITE_TUNING', True):
+        return []
+    pragmas = [
+        f"PRAGMA busy_timeout = {config.get('SQLITE_BUSY_TIMEOUT_MS', 5000)}",
+        f"PRAGMA cache_size = -{config.get('SQLITE_CACHE_SIZE_KB', 65536)}",
+        f"PRAGMA mmap_size = {config.get('SQLITE_MMAP_SIZE', 268435456)}",
+        'PRAGMA temp_store = MEMORY',
+    ]
+    if config.get('SQLITE_WAL', True):
+        # WAL lets readers proceed alongside the single writer; NORMAL sync is durable in WAL mode
+        pragmas = ['PRAGMA journal_mode = WAL', 'PRAGMA synchronous = NORMAL'] + pragmas
+    return pragmas
+
+
+def install_sqlite_pragmas(engine, pragmas):
+    """Run the given pragmas on each new connection of a SQLite engine"""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def configure_engines(app, db):
+    """Install the SQLite connection hook on every engine the app uses"""
+    pragmas = sqlite_pragmas_from_config(app.config)
+    with app.app_context():
+        for engine in db.engines.values():
+            install_sqlite_pragmas(engine, pragmas)
+
+
+def schema_fingerprint(metadatas):
+    """Hash table, column and index definitions of the given metadata objects"""
+    parts = []
+    for metadata in metadatas:
+        for table in metadata.sorted_tables:
+            parts.append(f'table {table.name}')
+            for column in table.columns:
+                parts.append(f'  {column.name} {column.type} nullable={column.nullable} pk={column.primary_key} unique={column.unique}')
+            for index in sorted(table.indexes, key=lambda index: index.name or ''):
+                parts.append(f'  index {index.name} {[column.name for column in index.columns]} unique={index.unique}')
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def read_schema_version(engine):
+    """Return the stored fingerprint, or None when the stamp table is missing"""
+    try:
+        with engine.connect() as connection:
+            return connection.execute(select(schema_version.c.version)).scalar()
+    except SQLAlchemyError:
+        return None
+
+
+def add_missing_columns(engine, metadata):
+    """
+    Add model columns missing from existing tables when that needs no backfill,
+    i.e. the column is nullable or has a server default. Returns their names;
+    raises SchemaMismatch, adding nothing, if any other column is missing.
+    """
+    inspector = inspect(engine)
+    missing = []
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        missing.extend((table, column) for column in table.columns if column.name not in existing)
+
+    required = [f'{table.name}.{column.name}' for table, column in missing
+                if not (column.nullable or column.server_default is not None)]
+    if required:
+        raise SchemaMismatch(f'Existing tables lack required columns: {", ".join(required)}')
+
+    with engine.begin() as connection:
+        for table, column in missing:
+            definition = CreateColumn(column).compile(dialect=engine.dialect)
+            table_name = engine.dialect.identifier_preparer.format_table(table)
+            connection.exec_driver_sql(f'ALTER TABLE {table_name} ADD COLUMN {definition}')
+    return [f'{table.name}.{column.name}' for table, column in missing]
+
+
+def add_missing_indexes(engine, metadata):
+    """
+    Create model indexes missing from existing tables; create_all() skips those
+    tables. An index the existing rows violate is skipped with a warning rather
+    than stopping startup. Returns the names of the skipped indexes.
+    """
+    skipped = []
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(engine, checkfirst=True)
+            except SQLAlchemyError as e:
+                logger.warning('Could not create index %s: %s', index.name, getattr(e, 'orig', e))
+                skipped.append(index.name)
+    return skipped
+
+
+def ensure_schema(db, upgrades=()):
+    """
+    Run create_all() only when the models changed since the stored stamp, and
+    add new columns and indexes to existing tables. upgrades are callables
+    taking the primary engine, run first to add columns that need a backfill.
+    Returns 'cached', 'current', 'created' or 'incomplete'. The stamp is only
+    written once the tables match the models, so an incomplete schema is
+    checked again on the next start.
+    """
+    fingerprint = schema_fingerprint(db.metadatas.values())
+    key = (str(db.engine.url), fingerprint)
+    if key in _checked_schemas:
+        return 'cached'
+
+    status = 'current'
+    if read_schema_version(db.engine) != fingerprint:
+        db.create_all()
+        for upgrade in upgrades:
+            upgrade(db.engine)
+        skipped = []
+        for bind_key, metadata in db.metadatas.items():
+            add_missing_columns(db.engines[bind_key], metadata)
+            skipped += add_missing_indexes(db.engines[bind_key], metadata)
+        if skipped:
+            return 'incomplete'
+        with db.engine.begin() as connection:
+            schema_version.create(connection, checkfirst=True)
+            connection.execute(schema_version.delete())
+            connection.execute(schema_version.insert(), {'version': fingerprint})
+        status = 'created'
+    _checked_schemas.add(key)
+    return status
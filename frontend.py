@@ -0,0 +1,116 @@
+"""
+Frontend Delivery
+Renders index.html once at startup and moves its inline CSS and JavaScript
+into content-hashed assets. Assets are served with immutable cache headers,
+so repeat visitors only revalidate the small HTML shell. Every file is
+precompressed with gzip and, when the brotli package is installed, brotli.
+"""
+
+import gzip
+import hashlib
+import re
+from flask import abort, current_app, render_template, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+ASSET_PREFIX = '/assets/'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+INLINE_STYLE = re.compile(r'<style>(.*?)</style>', re.S)
+INLINE_SCRIPT = re.compile(r'<script>(.*?)</script>', re.S)
+
+
+class StaticFile:
+    """A file held in memory with its precompressed variants and their ETags"""
+
+    def __init__(self, body, mimetype, cache_control):
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        # Most preferred encoding first; a variant is kept only if it is smaller
+        self.variants = {}
+        if brotli is not None:
+            self._add_variant('br', brotli.compress(body, quality=11), len(body))
+        self._add_variant('gzip', gzip.compress(body, compresslevel=9, mtime=0), len(body))
+        self.variants[None] = body
+
+    def _add_variant(self, encoding, data, size):
+        if len(data) < size:
+            self.variants[encoding] = data
+
+    def etag(self, encoding):
+        return self.digest if encoding is None else f'{self.digest}-{encoding}'
+
+    def respond(self):
+        """Serve the best variant the client accepts, or 304 if its copy is current"""
+        encoding = next(
+            (name for name in self.variants if name is None or request.accept_encodings[name]), None
+        )
+        if_none_match = request.if_none_match
+        if if_none_match and any(if_none_match.contains(self.etag(name)) for name in self.variants):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(self.variants[encoding], mimetype=self.mimetype)
+            if encoding is not None:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(self.etag(encoding))
+        response.headers['Cache-Control'] = self.cache_control
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+def build_frontend(app, template='index.html'):
+    """Render the template and split it into an HTML shell plus hashed assets"""
+    with app.app_context():
+        html = render_template(template)
+
+    assets = {}
+    stem = template.rsplit('.', 1)[0]
+
+    def extract(pattern, extension, mimetype, tag):
+        nonlocal html
+        match = pattern.search(html)
+        if match is None:
+            return
+        body = match.group(1).strip().encode('utf-8')
+        name = f'{stem}.{hashlib.sha256(body).hexdigest()[:12]}.{extension}'
+        assets[name] = StaticFile(body, mimetype, IMMUTABLE)
+        html = html[:match.start()] + tag % (ASSET_PREFIX + name) + html[match.end():]
+
+    extract(INLINE_STYLE, 'css', 'text/css', '<link rel="stylesheet" href="%s">')
+    extract(INLINE_SCRIPT, 'js', 'text/javascript', '<script src="%s"></script>')
+
+    page = StaticFile(html.encode('utf-8'), 'text/html', REVALIDATE)
+    return page, assets
+
+
+def init_frontend(app):
+    """
+    Register / and /assets/<name>. With FRONTEND_PRECOMPILE=false the page
+    is rendered on every request instead, which is handy while editing it.
+    """
+    if not app.config.get('FRONTEND_PRECOMPILE', True):
+        @app.route('/')
+        def index():
+            """Home page route"""
+            return render_template('index.html')
+        return
+
+    page, assets = build_frontend(app)
+
+    @app.route('/')
+    def index():
+        """Home page route: the prebuilt HTML shell"""
+        return page.respond()
+
+    @app.route(ASSET_PREFIX + '<name>')
+    def frontend_asset(name):
+        """Content-hashed CSS and JavaScript extracted from the page"""
+        asset = assets.get(name)
+        if asset is None:
+            abort(404)
+        return asset.respond()
@@ -0,0 +1,190 @@
+"""
+Password Hashing
+Runs bcrypt hashing and verification on a dedicated, bounded worker pool so
+that password work cannot starve the request threads serving cheap endpoints,
+and picks the bcrypt cost for this host.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+# bcrypt.gensalt() default cost
+DEFAULT_BCRYPT_ROUNDS = 12
+MIN_BCRYPT_ROUNDS = 4
+MAX_BCRYPT_ROUNDS = 31
+
+
+class PasswordPoolFull(Exception):
+    """Raised when the password pool queue is full and the task is rejected"""
+
+    def __init__(self, retry_after=1):
+        super().__init__('Password hashing pool is saturated')
+        self.retry_after = retry_after
+
+
+class PasswordPool:
+    """
+    Bounded thread pool for bcrypt work with admission control.
+    bcrypt releases the GIL while hashing, so threads scale across cores.
+    At most ``max_workers`` tasks run and ``max_queue`` more wait; anything
+    beyond that is rejected immediately with ``PasswordPoolFull``.
+    """
+
+    def __init__(self, max_workers=None, max_queue=32, retry_after=1, name='password'):
+        self.name = name
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix=f'{name}-pool'
+        )
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._peak_queued = 0
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def run(self, fn, *args):
+        """Run fn(*args) on the pool and block until it returns"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise PasswordPoolFull(self.retry_after)
+        return self._submit(fn, args).result()
+
+    def map(self, fn, args_list):
+        """
+        Run fn over many argument tuples and return results in order.
+        Bulk work waits for free slots instead of being rejected, and keeps
+        at most max_workers tasks in flight so interactive requests can
+        still queue behind it.
+        """
+        window = threading.Semaphore(self.max_workers)
+        futures = []
+        for args in args_list:
+            window.acquire()
+            self._slots.acquire()
+            futures.append(self._submit(fn, args, window.release))
+        return [future.result() for future in futures]
+
+    def _submit(self, fn, args, on_done=None):
+        """Submit a task holding an admission slot, tracking queue and wait stats"""
+        enqueued_at = time.perf_counter()
+        with self._lock:
+            self._submitted += 1
+            self._queued += 1
+            self._peak_queued = max(self._peak_queued, self._queued)
+
+        def release():
+            self._slots.release()
+            if on_done is not None:
+                on_done()
+
+        def task():
+            wait = time.perf_counter() - enqueued_at
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._completed += 1
+                release()
+
+        try:
+            return self._executor.submit(task)
+        except Exception:
+            with self._lock:
+                self._queued -= 1
+            release()
+            raise
+
+    def stats(self):
+        """Return a snapshot of queue depth and wait-time statistics"""
+        with self._lock:
+            started = self._completed + self._active
+            return {
+                'workers': self.max_workers,
+                'queue_limit': self.max_queue,
+                'queued': self._queued,
+                'active': self._active,
+                'peak_queued': self._peak_queued,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'wait_ms_avg': round(self._wait_total / started * 1000, 3) if started else 0.0,
+                'wait_ms_max': round(self._wait_max * 1000, 3)
+            }
+
+    def shutdown(self, wait=True):
+        """Stop accepting work and release worker threads"""
+        self._executor.shutdown(wait=wait)
+
+
+def create_password_pool(config):
+    """Create the password pool from app config, or None to hash inline"""
+    workers = config.get('PASSWORD_POOL_WORKERS')
+    if workers == 0:
+        return None
+    return PasswordPool(
+        max_workers=workers,
+        max_queue=config.get('PASSWORD_POOL_QUEUE', 32),
+        retry_after=config.get('PASSWORD_POOL_RETRY_AFTER', 1)
+    )
+
+
+def hash_password(password, rounds=DEFAULT_BCRYPT_ROUNDS):
+    """Hash a plaintext password; module-level so process pools can pickle it"""
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+
+def bcrypt_rounds(password_hash):
+    """Return the cost factor encoded in a bcrypt hash, or None if unparsable"""
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def calibrate_bcrypt_rounds(target_ms=50, min_rounds=MIN_BCRYPT_ROUNDS, max_rounds=MAX_BCRYPT_ROUNDS, samples=2):
+    """
+    Measure this host and return the highest bcrypt cost whose hash time
+    stays within target_ms. Each extra round doubles the work, so stop as
+    soon as the next cost would overshoot.
+    """
+    password = b'calibration-password'
+    rounds = min_rounds
+    while rounds < max_rounds:
+        elapsed = min(_time_hash(password, rounds) for _ in range(samples))
+        if elapsed * 2 * 1000 > target_ms:
+            break
+        rounds += 1
+    return rounds
+
+
+def _time_hash(password, rounds):
+    """Time a single bcrypt hash at the given cost in seconds"""
+    started = time.perf_counter()
+    bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+    return time.perf_counter() - started
+
+
+def resolve_bcrypt_rounds(config):
+    """Pick the bcrypt cost from config, calibrating on this host if asked to"""
+    if config.get('BCRYPT_CALIBRATE'):
+        return calibrate_bcrypt_rounds(config.get('BCRYPT_TARGET_MS', 50))
+    return config.get('BCRYPT_ROUNDS', DEFAULT_BCRYPT_ROUNDS)
@@ -0,0 +1,98 @@
+"""
+Health Probes
+Readiness check that runs a real query, reports its latency and pool
+saturation, and caches the result so frequent probes add no DB load.
+"""
+
+import threading
+import time
+from sqlalchemy import text
+
+
+def pool_status(engine):
+    """Return checked-out connections and saturation for pools that report them"""
+    pool = engine.pool
+    size = getattr(pool, 'size', None)
+    checkedout = getattr(pool, 'checkedout', None)
+    if not callable(size) or not callable(checkedout):
+        return {'type': type(pool).__name__}
+
+    capacity = size() + max(getattr(pool, '_max_overflow', 0), 0)
+    in_use = checkedout()
+    return {
+        'type': type(pool).__name__,
+        'size': size(),
+        'checked_out': in_use,
+        'capacity': capacity,
+        'saturation': round(in_use / capacity, 3) if capacity else 0.0
+    }
+
+
+class CachedCheck:
+    """
+    Result of a check function, re-run at most once per ttl seconds. Only one
+    caller runs it; the others keep the previous result meanwhile, and wait
+    only when there is none yet.
+    """
+
+    def __init__(self, run, ttl):
+        self.run = run
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.result = None
+        self._checked_at = 0.0
+
+    def get(self):
+        """Return the cached result, refreshing it when older than ttl"""
+        if self.result is not None and time.monotonic() - self._checked_at < self.ttl:
+            return self.result
+
+        if not self._lock.acquire(blocking=self.result is None):
+            return self.result
+        try:
+            if self.result is None or time.monotonic() - self._checked_at >= self.ttl:
+                self.result = self.run()
+                self._checked_at = time.monotonic()
+            return self.result
+        finally:
+            self._lock.release()
+
+    def set(self, result):
+        """Replace the result, keeping it until the next refresh is due"""
+        self.result = result
+        self._checked_at = time.monotonic()
+
+
+class ReadinessProbe:
+    """Runs SELECT 1 at most once per ttl seconds and shares the result"""
+
+    def __init__(self, db, ttl=2.0, max_latency_ms=250, max_saturation=0.9):
+        self.db = db
+        self.max_latency_ms = max_latency_ms
+        self.max_saturation = max_saturation
+        self._cached = CachedCheck(self._run, ttl)
+
+    def check(self):
+        """Return the cached readiness report, refreshing it when older than ttl"""
+        return self._cached.get()
+
+    def _run(self):
+        """Execute the probe query and build the report"""
+        report = {'checked_at': time.time()}
+        started = time.perf_counter()
+        try:
+            with self.db.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+            latency_ms = (time.perf_counter() - started) * 1000
+            report['database'] = 'connected'
+            report['latency_ms'] = round(latency_ms, 3)
+        except Exception as e:
+            report['database'] = 'disconnected'
+            report['error'] = type(e).__name__
+            report['ready'] = False
+            return report
+
+        report['pool'] = pool_status(self.db.engine)
+        saturation = report['pool'].get('saturation', 0.0)
+        report['ready'] = latency_ms <= self.max_latency_ms and saturation < self.max_saturation
+        return report
@@ -0,0 +1,380 @@
+"""
+Background Jobs
+In-process job queue for follow-up work that should not delay a response.
+Jobs enqueued in a request are dispatched only after its transaction
+commits, run on a pool of worker threads and are retried with exponential
+backoff. With JOBS_DATABASE_URL they are also kept in a SQLite job table:
+each process leases the jobs it runs, so jobs left behind by a crashed
+process are picked up by another once their lease expires.
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import (Column, DateTime, Float, Index, Integer, MetaData, String, Table, Text,
+                        create_engine, event, or_, select)
+
+from database import install_sqlite_pragmas, sqlite_pragmas_from_config
+
+logger = logging.getLogger(__name__)
+audit_logger = logging.getLogger('audit')
+
+
+class Job:
+    """A named task with a JSON-serializable payload"""
+
+    __slots__ = ('name', 'payload', 'id', 'attempts', 'run_at')
+
+    def __init__(self, name, payload=None, id=None, attempts=0, run_at=0.0):
+        self.name = name
+        self.payload = payload
+        self.id = id
+        self.attempts = attempts
+        self.run_at = run_at
+
+
+class JobStore:
+    """SQLite job table; rows are leased by the process that runs them"""
+
+    def __init__(self, url, lease=300, pragmas=()):
+        self.lease = lease
+        self.engine = create_engine(url)
+        install_sqlite_pragmas(self.engine, pragmas)
+        metadata = MetaData()
+        self.table = Table(
+            'jobs', metadata,
+            Column('id', Integer, primary_key=True),
+            Column('name', String(100), nullable=False),
+            Column('payload', Text, nullable=True),
+            Column('status', String(10), nullable=False, default='pending'),
+            Column('attempts', Integer, nullable=False, default=0),
+            Column('run_at', Float, nullable=False),
+            Column('claimed_by', String(100), nullable=True),
+            Column('claimed_at', Float, nullable=True),
+            Column('last_error', Text, nullable=True),
+            Column('created_at', DateTime, default=datetime.utcnow),
+            Index('ix_jobs_status_run_at', 'status', 'run_at')
+        )
+        metadata.create_all(self.engine)
+        # Leave no pooled connections behind for forked workers to share
+        self.engine.dispose()
+
+    @property
+    def owner(self):
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    def add(self, jobs):
+        """Insert jobs leased to this process and set their ids"""
+        now = time.time()
+        with self.engine.begin() as connection:
+            for job in jobs:
+                job.id = connection.execute(self.table.insert().values(
+                    name=job.name, payload=json.dumps(job.payload), attempts=job.attempts,
+                    run_at=job.run_at, claimed_by=self.owner, claimed_at=now
+                )).inserted_primary_key[0]
+
+    def claim(self, job_id):
+        """Lease a job to this process unless another process holds a live lease"""
+        now = time.time()
+        table = self.table
+        with self.engine.begin() as connection:
+            result = connection.execute(table.update().where(
+                table.c.id == job_id,
+                table.c.status == 'pending',
+                or_(table.c.claimed_by.is_(None), table.c.claimed_by == self.owner,
+                    table.c.claimed_at < now - self.lease)
+            ).values(claimed_by=self.owner, claimed_at=now))
+        return result.rowcount == 1
+
+    def claim_due(self, limit=100):
+        """Lease due jobs that nobody holds, e.g. those of a crashed process"""
+        now = time.time()
+        table = self.table
+        with self.engine.connect() as connection:
+            rows = connection.execute(select(table).where(
+                table.c.status == 'pending',
+                table.c.run_at <= now,
+                or_(table.c.claimed_by.is_(None), table.c.claimed_at < now - self.lease)
+            ).order_by(table.c.run_at).limit(limit)).mappings().all()
+        return [
+            Job(row['name'], json.loads(row['payload']), row['id'], row['attempts'], row['run_at'])
+            for row in rows if self.claim(row['id'])
+        ]
+
+    def complete(self, job):
+        with self.engine.begin() as connection:
+            connection.execute(self.table.delete().where(self.table.c.id == job.id))
+
+    def reschedule(self, job, error):
+        with self.engine.begin() as connection:
+            connection.execute(self.table.update().where(self.table.c.id == job.id).values(
+                attempts=job.attempts, run_at=job.run_at, claimed_at=time.time(), last_error=error
+            ))
+
+    def fail(self, job, error):
+        with self.engine.begin() as connection:
+            connection.execute(self.table.update().where(self.table.c.id == job.id).values(
+                status='failed', attempts=job.attempts, claimed_by=None, last_error=error
+            ))
+
+    def release(self, jobs):
+        """Give up leases so another process can run these jobs straight away"""
+        ids = [job.id for job in jobs]
+        if not ids:
+            return
+        with self.engine.begin() as connection:
+            connection.execute(self.table.update().where(
+                self.table.c.id.in_(ids), self.table.c.claimed_by == self.owner
+            ).values(claimed_by=None, claimed_at=None))
+
+
+class JobQueue:
+    """Worker threads running registered tasks, with retries and post-commit dispatch"""
+
+    def __init__(self, app, db, workers=2, max_attempts=5, backoff=1.0, max_backoff=300,
+                 store=None, poll_interval=5.0):
+        self.app = app
+        self.db = db
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.store = store
+        self.poll_interval = poll_interval
+        self.tasks = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._pid = None
+        self._closing = False
+        self._running = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.abandoned = 0
+        self._pending_key = 'job_queue_pending'
+
+    def task(self, name):
+        """Register the decorated function as the handler for jobs called name"""
+        def decorator(fn):
+            self.tasks[name] = fn
+            return fn
+        return decorator
+
+    def enqueue(self, name, payload=None):
+        """Queue a job to be dispatched once the current transaction commits"""
+        if name not in self.tasks:
+            raise KeyError(f'Unknown job: {name}')
+        self.db.session.info.setdefault(self._pending_key, []).append(Job(name, payload))
+
+    def bind_session_events(self):
+        def dispatch_committed(session):
+            jobs = session.info.pop(self._pending_key, None)
+            if jobs:
+                self.dispatch(jobs)
+
+        def discard(session):
+            session.info.pop(self._pending_key, None)
+
+        event.listen(self.db.session, 'after_commit', dispatch_committed)
+        event.listen(self.db.session, 'after_rollback', discard)
+
+    def dispatch(self, jobs):
+        """Hand jobs to the workers now, persisting them first when durable"""
+        now = time.time()
+        for job in jobs:
+            job.run_at = now
+        if self.store is not None:
+            try:
+                self.store.add(jobs)
+            except Exception:
+                logger.exception('Could not persist %d jobs, running them without durability', len(jobs))
+        if self.workers == 0:
+            for job in jobs:
+                self._execute(job)
+            return
+        self.start()
+        with self._condition:
+            for job in jobs:
+                heapq.heappush(self._heap, (job.run_at, next(self._sequence), job))
+            self._condition.notify(len(jobs))
+
+    def start(self):
+        """Start worker threads on first use in each process (threads do not survive fork)"""
+        if self._pid == os.getpid() or self._closing or self.workers == 0:
+            return
+        with self._condition:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._heap = []
+            self._threads = [
+                threading.Thread(target=self._work, name=f'jobs-{n}', daemon=True)
+                for n in range(self.workers)
+            ]
+            if self.store is not None:
+                self._threads.append(threading.Thread(target=self._recover, name='jobs-recovery', daemon=True))
+            for thread in self._threads:
+                thread.start()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.time()
+                    if self._heap and self._heap[0][0] <= now:
+                        _, _, job = heapq.heappop(self._heap)
+                        self._running += 1
+                        break
+                    if self._closing:
+                        return
+                    self._condition.wait(self._heap[0][0] - now if self._heap else None)
+            try:
+                self._execute(job)
+            finally:
+                with self._condition:
+                    self._running -= 1
+
+    def _recover(self):
+        """Periodically adopt unleased due jobs from the job table"""
+        while not self._closing:
+            try:
+                jobs = self.store.claim_due()
+            except Exception:
+                logger.exception('Job recovery scan failed')
+                jobs = []
+            if jobs:
+                with self._condition:
+                    for job in jobs:
+                        heapq.heappush(self._heap, (job.run_at, next(self._sequence), job))
+                    self._condition.notify(len(jobs))
+            with self._condition:
+                self._condition.wait_for(lambda: self._closing, self.poll_interval)
+
+    def _execute(self, job):
+        """Run one attempt of a job, then complete, reschedule or fail it"""
+        if self.store is not None and job.id is not None and not self.store.claim(job.id):
+            # Another process took over the lease
+            return
+        job.attempts += 1
+        try:
+            with self.app.app_context():
+                self.tasks[job.name](job.payload)
+        except Exception as e:
+            self._handle_failure(job, f'{type(e).__name__}: {e}')
+            return
+        self.completed += 1
+        if self.store is not None and job.id is not None:
+            self.store.complete(job)
+
+    def _handle_failure(self, job, error):
+        # Inline mode (no workers) has no scheduler to retry on, so one attempt is final
+        if job.attempts >= self.max_attempts or self.workers == 0:
+            self.failed += 1
+            logger.error('Job %s failed after %d attempts: %s', job.name, job.attempts, error)
+            if self.store is not None and job.id is not None:
+                self.store.fail(job, error)
+            return
+
+        self.retried += 1
+        job.run_at = time.time() + self.retry_delay(job.attempts)
+        logger.warning('Job %s attempt %d failed, retrying in %.1fs: %s',
+                       job.name, job.attempts, job.run_at - time.time(), error)
+        if self.store is not None and job.id is not None:
+            self.store.reschedule(job, error)
+        with self._condition:
+            heapq.heappush(self._heap, (job.run_at, next(self._sequence), job))
+            self._condition.notify()
+
+    def retry_delay(self, attempts):
+        """Exponential backoff with full jitter, capped at max_backoff"""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempts - 1)))
+
+    def close(self, timeout=10):
+        """Finish due jobs, then stop; jobs still waiting to retry are released or dropped"""
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        if self._pid == os.getpid():
+            deadline = time.monotonic() + timeout
+            for thread in self._threads:
+                thread.join(max(0, deadline - time.monotonic()))
+        with self._condition:
+            left = [job for _, _, job in self._heap]
+            self._heap = []
+        if not left:
+            return
+        if self.store is not None:
+            self.store.release([job for job in left if job.id is not None])
+        else:
+            self.abandoned += len(left)
+            logger.warning('Dropped %d queued jobs at shutdown', len(left))
+
+    def stats(self):
+        with self._condition:
+            queued, running = len(self._heap), self._running
+        return {
+            'workers': self.workers,
+            'durable': self.store is not None,
+            'queued': queued,
+            'running': running,
+            'completed': self.completed,
+            'retried': self.retried,
+            'failed': self.failed,
+            'abandoned': self.abandoned
+        }
+
+
+def register_user_tasks(queue):
+    """Follow-up work for account changes; each task writes one audit record"""
+    def audit(event_name, payload):
+        audit_logger.info(json.dumps(dict(payload, event=event_name, at=datetime.utcnow().isoformat())))
+
+    @queue.task('user.registered')
+    def user_registered(payload):
+        # Welcome notifications hook in here
+        audit('user.registered', payload)
+
+    @queue.task('user.updated')
+    def user_updated(payload):
+        audit('user.updated', payload)
+
+    @queue.task('user.deleted')
+    def user_deleted(payload):
+        # Cleanup of data keyed by the user id hooks in here
+        audit('user.deleted', payload)
+
+
+def create_job_queue(app, db):
+    """Build the job queue from app config and hook it to session commits"""
+    store = None
+    if app.config.get('JOBS_DATABASE_URL'):
+        store = JobStore(
+            app.config['JOBS_DATABASE_URL'],
+            lease=app.config.get('JOBS_LEASE_SECONDS', 300),
+            pragmas=sqlite_pragmas_from_config(app.config)
+        )
+    queue = JobQueue(
+        app, db,
+        workers=app.config.get('JOBS_WORKERS', 2),
+        max_attempts=app.config.get('JOBS_MAX_ATTEMPTS', 5),
+        backoff=app.config.get('JOBS_BACKOFF_SECONDS', 1.0),
+        max_backoff=app.config.get('JOBS_MAX_BACKOFF_SECONDS', 300),
+        store=store,
+        poll_interval=app.config.get('JOBS_POLL_INTERVAL', 5.0)
+    )
+    queue.bind_session_events()
+    register_user_tasks(queue)
+
+    # Durable queues also adopt leftover jobs in processes that never enqueue
+    if store is not None:
+        app.before_request(queue.start)
+    return queue
@@ -0,0 +1,381 @@
+"""
+Metrics
+Prometheus text-format metrics for request latency, password hashing and
+database queries. Each thread writes to its own shard without locking;
+shards are merged only when /metrics is scraped. Under the pre-fork server
+each worker also saves its totals to METRICS_DIR, and the worker answering a
+scrape adds its siblings' files so every scrape covers the whole server.
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+class _Family:
+    """A labelled metric whose values live in per-thread shards"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = {}
+
+    def _values(self):
+        """Return the calling thread's shard, registering it on first use"""
+        values = getattr(self._local, 'values', None)
+        if values is None:
+            values = self._local.values = {}
+            with self._lock:
+                self._retire_dead_shards()
+                self._shards.append((threading.current_thread(), values))
+        return values
+
+    def _retire_dead_shards(self):
+        """Fold shards of finished threads into one, keeping the shard list short"""
+        alive = []
+        for thread, values in self._shards:
+            if thread.is_alive():
+                alive.append((thread, values))
+            else:
+                for labels, value in values.items():
+                    self._merge(self._retired, labels, value)
+        self._shards = alive
+
+    def reset(self):
+        """Drop every value, e.g. those a forked worker inherited from the master"""
+        with self._lock:
+            self._local = threading.local()
+            self._shards = []
+            self._retired = {}
+
+    def collect(self):
+        """Merge every shard into {labels: value}"""
+        with self._lock:
+            self._retire_dead_shards()
+            merged = {}
+            for labels, value in self._retired.items():
+                self._merge(merged, labels, value)
+            for _, values in self._shards:
+                for labels, value in list(values.items()):
+                    self._merge(merged, labels, value)
+        return merged
+
+    def _format_labels(self, labels, extra=()):
+        pairs = list(zip(self.labelnames, labels)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+class Counter(_Family):
+    """Monotonic counter"""
+
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        values = self._values()
+        values[labels] = values.get(labels, 0) + amount
+
+    @staticmethod
+    def _merge(target, labels, value):
+        target[labels] = target.get(labels, 0) + value
+
+    def render(self, values):
+        lines = []
+        for labels, value in sorted(values.items()):
+            lines.append(f'{self.name}{self._format_labels(labels)} {value}')
+        return lines
+
+
+class Histogram(_Family):
+    """Histogram with fixed upper bounds"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        values = self._values()
+        state = values.get(labels)
+        if state is None:
+            # Per-bucket counts (last slot is +Inf), then sum
+            state = values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    @staticmethod
+    def _merge(target, labels, value):
+        current = target.get(labels)
+        if current is None:
+            target[labels] = list(value)
+        else:
+            for index, item in enumerate(value):
+                current[index] += item
+
+    def render(self, values):
+        lines = []
+        for labels, state in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state[:-1]):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{self._format_labels(labels, [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{self._format_labels(labels)} {state[-1]}')
+            lines.append(f'{self.name}_count{self._format_labels(labels)} {cumulative}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Registry:
+    """Collection of metric families rendered together"""
+
+    def __init__(self):
+        self.families = []
+
+    def register(self, family):
+        self.families.append(family)
+        return family
+
+    def snapshot(self):
+        """This process's values as {family name: [[labels, value], ...]}, JSON-serializable"""
+        return {
+            family.name: [[list(labels), value] for labels, value in family.collect().items()]
+            for family in self.families
+        }
+
+    def merge(self, snapshots):
+        """Sum several snapshots into one"""
+        merged = {}
+        for family in self.families:
+            values = {}
+            for snapshot in snapshots:
+                for labels, value in snapshot.get(family.name, ()):
+                    family._merge(values, tuple(labels), value)
+            merged[family.name] = [[list(labels), value] for labels, value in values.items()]
+        return merged
+
+    def reset(self):
+        for family in self.families:
+            family.reset()
+
+    def render(self, snapshots=()):
+        """Render this process's values plus those of other processes' snapshots"""
+        lines = []
+        for family in self.families:
+            values = family.collect()
+            for snapshot in snapshots:
+                for labels, value in snapshot.get(family.name, ()):
+                    family._merge(values, tuple(labels), value)
+            lines.append(f'# HELP {family.name} {family.documentation}')
+            lines.append(f'# TYPE {family.name} {family.kind}')
+            lines.extend(family.render(values))
+        return '\n'.join(lines) + '\n'
+
+
+RETIRED_FILE = 'retired.json'
+
+# Names of folded worker files remembered in the retired file, for scrapes racing a fold
+RETIRED_NAMES_KEPT = 64
+
+
+def _read_json(path):
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as handle:
+        json.dump(data, handle)
+    os.replace(temporary, path)
+
+
+class SharedMetrics:
+    """
+    Snapshot files of the worker processes of one server in a shared directory.
+    Each worker rewrites its own file every interval seconds and on shutdown.
+    When the master reaps a worker it folds that file into a single retired
+    file, so counters never go backwards and the directory does not grow.
+    """
+
+    def __init__(self, registry, directory, interval=1.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self._pid = None
+        self._path = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Name this process's file and start its writer, once per pid"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # Unique per process so a reused pid cannot overwrite an exited worker's totals
+            self._path = os.path.join(self.directory, f'worker-{self._pid}-{uuid.uuid4().hex[:8]}.json')
+        threading.Thread(target=self._run, name='metrics-writer', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.write()
+
+    def write(self):
+        """Atomically replace this process's snapshot file"""
+        self.start()
+        _write_json(self._path, self.registry.snapshot())
+
+    def retire(self, pid):
+        """Fold the files of an exited worker into the retired file; called by the master only"""
+        paths = glob.glob(os.path.join(self.directory, f'worker-{pid}-*.json'))
+        if not paths:
+            return
+        retired_path = os.path.join(self.directory, RETIRED_FILE)
+        retired = _read_json(retired_path) or {'values': {}, 'folded': []}
+        snapshots = [retired['values']] + [snapshot for snapshot in map(_read_json, paths) if snapshot]
+        # Written before the worker files are removed: a scrape sees each value exactly once
+        _write_json(retired_path, {
+            'values': self.registry.merge(snapshots),
+            'folded': (retired['folded'] + [os.path.basename(path) for path in paths])[-RETIRED_NAMES_KEPT:]
+        })
+        for path in paths:
+            os.remove(path)
+
+    def siblings(self):
+        """Snapshots saved by every other worker, plus the retired totals"""
+        self.start()
+        workers = {}
+        for path in glob.glob(os.path.join(self.directory, 'worker-*.json')):
+            if path != self._path:
+                workers[os.path.basename(path)] = _read_json(path)
+        # Read after the worker files: one folded since is then listed here and not counted twice
+        retired = _read_json(os.path.join(self.directory, RETIRED_FILE)) or {'values': {}, 'folded': []}
+        folded = set(retired['folded'])
+        return [retired['values']] + [
+            snapshot for name, snapshot in workers.items() if snapshot and name not in folded
+        ]
+
+    def render(self):
+        return self.registry.render(self.siblings())
+
+    def close(self):
+        if self._pid == os.getpid():
+            self.write()
+
+
+def clear_shared_metrics(directory):
+    """Remove snapshot files left by a previous run of the server"""
+    for pattern in ('worker-*.json*', RETIRED_FILE + '*'):
+        for path in glob.glob(os.path.join(directory, pattern)):
+            os.remove(path)
+
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    'http_requests_total', 'HTTP requests by endpoint and status class',
+    ('blueprint', 'endpoint', 'method', 'status')
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    'http_request_duration_seconds', 'HTTP request latency',
+    ('blueprint', 'endpoint')
+))
+PASSWORD_SECONDS = registry.register(Histogram(
+    'password_operation_duration_seconds', 'Time spent in bcrypt hash and verify, including pool wait',
+    ('operation',)
+))
+QUERY_SECONDS = registry.register(Histogram(
+    'db_query_duration_seconds', 'Database statement execution time'
+))
+QUERIES_PER_REQUEST = registry.register(Histogram(
+    'db_queries_per_request', 'Database statements executed per HTTP request',
+    ('blueprint', 'endpoint'), buckets=COUNT_BUCKETS
+))
+
+
+def observe_password(operation, started):
+    """Record a bcrypt operation that began at perf_counter() value started"""
+    PASSWORD_SECONDS.observe(time.perf_counter() - started, (operation,))
+
+
+def instrument_engine(engine):
+    """Time every statement and count statements per request"""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['metrics_query_start'].pop()
+        QUERY_SECONDS.observe(time.perf_counter() - started)
+        if has_request_context():
+            g.metrics_query_count = g.get('metrics_query_count', 0) + 1
+
+
+def init_metrics(app, db):
+    """
+    Install request hooks, engine instrumentation and the /metrics endpoint.
+    Returns the SharedMetrics when METRICS_DIR is set, else None.
+    """
+    shared = None
+    if app.config.get('METRICS_DIR'):
+        shared = SharedMetrics(registry, app.config['METRICS_DIR'], app.config.get('METRICS_SYNC_INTERVAL', 1.0))
+        # Workers start from zero rather than each repeating the master's startup counts
+        os.register_at_fork(after_in_child=registry.reset)
+        app.extensions['shared_metrics'] = shared
+
+    with app.app_context():
+        for engine in db.engines.values():
+            instrument_engine(engine)
+
+    @app.before_request
+    def start_request_timer():
+        if shared is not None:
+            shared.start()
+        g.metrics_started = time.perf_counter()
+        g.metrics_query_count = 0
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None and request.endpoint != 'metrics':
+            endpoint = request.endpoint or 'unmatched'
+            labels = (request.blueprint or '', endpoint)
+            REQUEST_SECONDS.observe(time.perf_counter() - started, labels)
+            QUERIES_PER_REQUEST.observe(g.get('metrics_query_count', 0), labels)
+            REQUESTS.inc(labels[:1] + (endpoint, request.method, f'{response.status_code // 100}xx'))
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus metrics endpoint"""
+        body = shared.render() if shared is not None else registry.render()
+        return Response(body, mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    return shared
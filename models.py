@@ -6,9 +6,70 @@ Defines the database schema and models for the Flask application.
 from datetime import datetime
 import bcrypt
 import re
+import time
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.orm import validates
+from hashing import DEFAULT_BCRYPT_ROUNDS, bcrypt_rounds
+from metrics import observe_password
 
-def create_user_model(db):
+# Validation patterns, compiled once rather than looked up on every call
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+USERNAME_PATTERN = re.compile(r'^[a-zA-Z0-9_]+$')
+UPPERCASE_PATTERN = re.compile(r'[A-Z]')
+LOWERCASE_PATTERN = re.compile(r'[a-z]')
+DIGIT_PATTERN = re.compile(r'\d')
+
+def add_lookup_columns(engine, table):
+    """
+    Add and backfill username_lower/email_lower on a users table created before
+    they existed. Returns the names of the columns added.
+    """
+    if not inspect(engine).has_table(table.name):
+        return []
+    existing = {column['name'] for column in inspect(engine).get_columns(table.name)}
+    added = [name for name in ('username_lower', 'email_lower') if name not in existing]
+    if not added:
+        return []
+    with engine.begin() as connection:
+        for name in added:
+            # Added nullable: existing rows get their values from the backfill below
+            column_type = table.c[name].type.compile(dialect=engine.dialect)
+            connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {name} {column_type}'))
+        connection.execute(table.update().values(
+            username_lower=func.lower(func.trim(table.c.username)),
+            email_lower=func.lower(func.trim(table.c.email)),
+            # Not a profile change: keep updated_at (and the ETags and snapshots keyed on it)
+            updated_at=table.c.updated_at
+        ))
+    return added
+
+
+def lookup_duplicates(connection, table):
+    """Usernames and emails held by more than one user once lowercased, as {column: {value: [usernames]}}"""
+    duplicates = {}
+    for name in ('username_lower', 'email_lower'):
+        column = table.c[name]
+        taken = select(column).group_by(column).having(func.count() > 1).scalar_subquery()
+        rows = connection.execute(
+            select(column, table.c.username).where(column.in_(taken)).order_by(column, table.c.id)
+        )
+        for value, username in rows:
+            duplicates.setdefault(name, {}).setdefault(value, []).append(username)
+    return duplicates
+
+
+def create_user_model(db, password_pool=None, rounds=DEFAULT_BCRYPT_ROUNDS):
     """Create User model with SQLAlchemy"""
+    def run_password_task(operation, fn, *args):
+        """Run bcrypt work on the password pool, or inline if there is none, and time it"""
+        started = time.perf_counter()
+        try:
+            if password_pool is None:
+                return fn(*args)
+            return password_pool.run(fn, *args)
+        finally:
+            observe_password(operation, started)
+
     class User(db.Model):
         """
         User model for authentication and user management.
@@ -16,50 +77,118 @@ def create_user_model(db):
         """
         
         __tablename__ = 'users'
+        __table_args__ = (
+            db.Index('ix_users_username_lower', 'username_lower', unique=True),
+            db.Index('ix_users_email_lower', 'email_lower', unique=True),
+        )
         
         id = db.Column(db.Integer, primary_key=True)
         username = db.Column(db.String(80), unique=True, nullable=False)
         email = db.Column(db.String(120), unique=True, nullable=False)
+        # Lowercased copies used for case-insensitive, indexed lookups
+        username_lower = db.Column(db.String(80), nullable=False)
+        email_lower = db.Column(db.String(120), nullable=False)
         password_hash = db.Column(db.String(255), nullable=False)
         first_name = db.Column(db.String(50), nullable=True)
         last_name = db.Column(db.String(50), nullable=True)
         is_active = db.Column(db.Boolean, default=True)
         created_at = db.Column(db.DateTime, default=datetime.utcnow)
         updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+        # Login activity, written in batches by activity.LoginActivityBuffer
+        last_login_at = db.Column(db.DateTime, nullable=True)
+        last_login_ip = db.Column(db.String(45), nullable=True)
+        login_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+        failed_login_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
         
-        def __init__(self, username, email, password, first_name=None, last_name=None):
-            """Initialize user with hashed password"""
+        def __init__(self, username, email, password=None, first_name=None, last_name=None, password_hash=None):
+            """Initialize user with hashed password, or with an already computed hash"""
             self.username = username
             self.email = email
-            self.password_hash = self._hash_password(password)
+            self.password_hash = password_hash or self._hash_password(password)
             self.first_name = first_name
             self.last_name = last_name
         
+        @validates('username', 'email')
+        def _normalize_lookup(self, key, value):
+            """Keep the lowercased lookup columns in sync with username and email"""
+            setattr(self, f'{key}_lower', User.normalize(value))
+            return value
+        
+        @staticmethod
+        def normalize(value):
+            """Normalize a username or email for lookups and uniqueness"""
+            return value.strip().lower() if value else value
+        
+        @classmethod
+        def find_by_identifier(cls, identifier):
+            """Find a user by username or email, ignoring case"""
+            key = cls.normalize(identifier)
+            if '@' in key:
+                return cls.query.filter_by(email_lower=key).first()
+            return cls.query.filter_by(username_lower=key).first()
+        
+        @classmethod
+        def find_conflict(cls, username=None, email=None):
+            """Return the conflict message for a taken username or email, in one query"""
+            username_key, email_key = cls.normalize(username), cls.normalize(email)
+            rows = db.session.query(cls.username_lower, cls.email_lower).filter(
+                db.or_(cls.username_lower == username_key, cls.email_lower == email_key)
+            ).limit(2).all()
+            if any(row.username_lower == username_key for row in rows):
+                return 'Username already exists'
+            if any(row.email_lower == email_key for row in rows):
+                return 'Email already exists'
+            return None
+        
         def _hash_password(self, password):
             """Hash password using bcrypt"""
-            salt = bcrypt.gensalt()
-            return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+            salt = bcrypt.gensalt(rounds=rounds)
+            return run_password_task('hash', bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+        
+        @staticmethod
+        def hash_passwords(passwords):
+            """Hash many passwords in parallel across the password pool's workers"""
+            args_list = [(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)) for password in passwords]
+            if password_pool is None:
+                hashes = [bcrypt.hashpw(*args) for args in args_list]
+            else:
+                hashes = password_pool.map(bcrypt.hashpw, args_list)
+            return [password_hash.decode('utf-8') for password_hash in hashes]
         
         def verify_password(self, password):
-            """Verify password against stored hash"""
-            return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+            """Verify password against stored hash, upgrading its cost on success"""
+            is_valid = run_password_task('verify', bcrypt.checkpw, password.encode('utf-8'), self.password_hash.encode('utf-8'))
+            if is_valid and self.needs_rehash():
+                self._rehash_password(password)
+            return is_valid
+        
+        def needs_rehash(self):
+            """Check whether the stored hash uses a different cost than configured"""
+            return bcrypt_rounds(self.password_hash) != rounds
+        
+        def _rehash_password(self, password):
+            """Rehash with the configured cost and persist; failures keep the old hash"""
+            try:
+                self.password_hash = self._hash_password(password)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
         
         @staticmethod
         def validate_email(email):
             """Validate email format"""
-            pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-            return re.match(pattern, email) is not None
+            return EMAIL_PATTERN.match(email) is not None
         
         @staticmethod
         def validate_password(password):
             """Validate password strength"""
             if len(password) < 8:
                 return False, "Password must be at least 8 characters long"
-            if not re.search(r'[A-Z]', password):
+            if not UPPERCASE_PATTERN.search(password):
                 return False, "Password must contain at least one uppercase letter"
-            if not re.search(r'[a-z]', password):
+            if not LOWERCASE_PATTERN.search(password):
                 return False, "Password must contain at least one lowercase letter"
-            if not re.search(r'\d', password):
+            if not DIGIT_PATTERN.search(password):
                 return False, "Password must contain at least one digit"
             return True, "Password is valid"
         
@@ -68,7 +197,7 @@ def create_user_model(db):
             """Validate username format"""
             if len(username) < 3 or len(username) > 20:
                 return False, "Username must be between 3 and 20 characters"
-            if not re.match(r'^[a-zA-Z0-9_]+$', username):
+            if not USERNAME_PATTERN.match(username):
                 return False, "Username can only contain letters, numbers, and underscores"
             return True, "Username is valid"
         
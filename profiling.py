@@ -0,0 +1,82 @@
+"""
+Query Profiling
+Opt-in per-request SQL profiler: records every statement with its timing,
+flags statements repeated within one request (N+1 patterns) and writes
+slow requests to a structured JSON log.
+"""
+
+import json
+import logging
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger('profiling')
+
+
+def instrument_engine(engine):
+    """Record each statement executed during a request on flask.g"""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profiling_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['profiling_query_start'].pop()
+        if has_request_context() and 'profile_queries' in g:
+            g.profile_queries.append({
+                'statement': statement,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+                'executemany': executemany
+            })
+
+
+def find_repeated(queries, threshold):
+    """Return {statement: count} for statements run at least threshold times"""
+    counts = {}
+    for query in queries:
+        counts[query['statement']] = counts.get(query['statement'], 0) + 1
+    return {statement: count for statement, count in counts.items() if count >= threshold}
+
+
+def init_profiling(app, db):
+    """Install the profiler when QUERY_PROFILING is enabled"""
+    if not app.config.get('QUERY_PROFILING'):
+        return
+
+    slow_ms = app.config.get('SLOW_REQUEST_MS', 500)
+    repeat_threshold = app.config.get('REPEATED_QUERY_THRESHOLD', 2)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            instrument_engine(engine)
+
+    @app.before_request
+    def start_profile():
+        g.profile_started = time.perf_counter()
+        g.profile_queries = []
+
+    @app.after_request
+    def report_profile(response):
+        started = g.pop('profile_started', None)
+        queries = g.pop('profile_queries', None)
+        if started is None:
+            return response
+
+        duration_ms = (time.perf_counter() - started) * 1000
+        repeated = find_repeated(queries, repeat_threshold)
+        record = {
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 3),
+            'query_count': len(queries),
+            'query_ms': round(sum(query['duration_ms'] for query in queries), 3)
+        }
+
+        if repeated:
+            logger.warning(json.dumps(dict(record, event='repeated_queries', repeated=repeated)))
+        if duration_ms >= slow_ms:
+            logger.warning(json.dumps(dict(record, event='slow_request', queries=queries)))
+        return response
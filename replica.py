@@ -0,0 +1,212 @@
+"""
+Read Replica Routing
+Sends read-only GET handlers to an optional replica bind. Writes, and reads
+by users who wrote within the read-your-writes window, stay on the primary;
+an unhealthy replica falls back to the primary until it answers again, and
+a view whose replica read failed is run once more against the primary.
+"""
+
+import threading
+import time
+from functools import wraps
+from flask import current_app, has_app_context
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from health import CachedCheck
+
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(Session):
+    """Session that reads from the replica when the current view opted in"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        route = self.info.get('replica_route')
+        # Flushes are writes and always go to the primary
+        if route is not None and engine is route[0] and not self._flushing:
+            return route[1]
+        return engine
+
+
+def replica_session_options(config):
+    """Session options for SQLAlchemy(): the routing session when a replica is configured"""
+    return {'class_': RoutingSession} if config.get('REPLICA_DATABASE_URL') else {}
+
+
+def read_only(view):
+    """
+    Mark a view as read-only so its queries may be served by the replica.
+    Views catch their own errors, so a replica failure is detected from the
+    error hook's flag rather than an exception, and the view is run again.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        router = current_app.extensions.get('replica_router')
+        if router is None or not router.route_reads(get_jwt_identity()):
+            return view(*args, **kwargs)
+        try:
+            response = view(*args, **kwargs)
+        except Exception:
+            if not router.take_failure():
+                raise
+        else:
+            if not router.take_failure():
+                return response
+        router.route_to_primary()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """Decides per request whether reads can use the replica"""
+
+    def __init__(self, db, table_name, read_your_writes=5.0, check_interval=5.0, max_writers=100000):
+        self.db = db
+        self.table_name = table_name
+        self.read_your_writes = read_your_writes
+        self.max_writers = max_writers
+        self._recent_writes = {}
+        self._lock = threading.Lock()
+        self._health = CachedCheck(self._probe, check_interval)
+        self.replica_reads = 0
+        self.primary_recent_write = 0
+        self.primary_unhealthy = 0
+        self.primary_retries = 0
+
+    @property
+    def primary(self):
+        return self.db.engines[None]
+
+    @property
+    def replica(self):
+        return self.db.engines[REPLICA_BIND]
+
+    def route_reads(self, identity=None):
+        """Point the current session's reads at the replica if that is safe"""
+        if identity is not None and self.wrote_recently(identity):
+            self.primary_recent_write += 1
+            return False
+        if not self.healthy():
+            self.primary_unhealthy += 1
+            return False
+        self.replica_reads += 1
+        self.db.session.info['replica_route'] = (self.primary, self.replica)
+        return True
+
+    def route_to_primary(self):
+        """Discard the failed replica read and send the rest of the request to the primary"""
+        self.primary_retries += 1
+        self.db.session.rollback()
+        self.db.session.info.pop('replica_route', None)
+
+    def replica_failed(self):
+        """Called on replica errors: stop using it and flag the current request for a retry"""
+        self.mark_unhealthy()
+        if has_app_context():
+            self.db.session.info['replica_failed'] = True
+
+    def take_failure(self):
+        """Whether a replica error happened in the current request, clearing the flag"""
+        return self.db.session.info.pop('replica_failed', False)
+
+    def record_writes(self, identities):
+        """Start the read-your-writes window for users whose rows were just committed"""
+        until = time.monotonic() + self.read_your_writes
+        with self._lock:
+            if len(self._recent_writes) >= self.max_writers:
+                self._prune()
+            for identity in identities:
+                self._recent_writes[str(identity)] = until
+
+    def wrote_recently(self, identity):
+        until = self._recent_writes.get(str(identity))
+        return until is not None and until > time.monotonic()
+
+    def _prune(self):
+        """Drop expired windows, and the oldest ones if still over capacity"""
+        now = time.monotonic()
+        self._recent_writes = {key: until for key, until in self._recent_writes.items() if until > now}
+        if len(self._recent_writes) >= self.max_writers:
+            keep = sorted(self._recent_writes.items(), key=lambda item: item[1])[-(self.max_writers // 2):]
+            self._recent_writes = dict(keep)
+
+    def healthy(self):
+        """Cached replica health, re-checked at most once per interval"""
+        return self._health.get()
+
+    def _probe(self):
+        """
+        The replica is healthy if its users table can be read and is not empty
+        while the primary's has rows, which catches a replica never synced.
+        """
+        statement = text(f'SELECT max(id) FROM {self.table_name}')
+        try:
+            with self.replica.connect() as connection:
+                replica_max = connection.execute(statement).scalar()
+            if replica_max is not None:
+                return True
+            with self.primary.connect() as connection:
+                return connection.execute(statement).scalar() is None
+        except Exception:
+            return False
+
+    def mark_unhealthy(self):
+        """Send reads to the primary until the next successful check"""
+        self._health.set(False)
+
+    def stats(self):
+        return {
+            'healthy': self._health.result,
+            'replica_reads': self.replica_reads,
+            'primary_recent_write': self.primary_recent_write,
+            'primary_unhealthy': self.primary_unhealthy,
+            'primary_retries': self.primary_retries,
+            'tracked_writers': len(self._recent_writes)
+        }
+
+
+def configure_replica(config):
+    """Add the replica bind to SQLALCHEMY_BINDS when REPLICA_DATABASE_URL is set"""
+    url = config.get('REPLICA_DATABASE_URL')
+    if url:
+        config['SQLALCHEMY_BINDS'] = dict(config.get('SQLALCHEMY_BINDS') or {}, **{REPLICA_BIND: url})
+
+
+def create_replica_router(app, db, User):
+    """Build the router and hook write tracking and replica errors, or None without a replica"""
+    if not app.config.get('REPLICA_DATABASE_URL'):
+        return None
+
+    router = ReplicaRouter(
+        db,
+        User.__tablename__,
+        read_your_writes=app.config.get('REPLICA_READ_YOUR_WRITES_SECONDS', 5),
+        check_interval=app.config.get('REPLICA_CHECK_INTERVAL', 5),
+        max_writers=app.config.get('REPLICA_MAX_TRACKED_WRITERS', 100000)
+    )
+
+    pending_key = 'replica_written_users'
+
+    def track(mapper, connection, target):
+        db.session.info.setdefault(pending_key, set()).add(target.id)
+
+    def record(session):
+        written = session.info.pop(pending_key, None)
+        if written:
+            router.record_writes(written)
+
+    def discard(session):
+        session.info.pop(pending_key, None)
+
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(User, name, track)
+    event.listen(db.session, 'after_commit', record)
+    event.listen(db.session, 'after_rollback', discard)
+
+    with app.app_context():
+        event.listen(router.replica, 'handle_error', lambda context: router.replica_failed())
+
+    app.extensions['replica_router'] = router
+    return router
@@ -3,16 +3,102 @@ Application Routes
 Defines all API endpoints for authentication and user management.
 """
 
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask import Blueprint, Response, current_app, request, jsonify, json, stream_with_context
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt, get_jwt_identity
+from hashing import PasswordPoolFull
+from throttle import LoginThrottled
+from claims import profile_claims, read_profile_claims
+from serialization import user_fragment
+from replica import read_only
+from conditional import collection_etag, not_modified, tag_response, user_etag
+from search import SearchTimeout
+from sharding import shard_of
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+import base64
 import re
 
-def create_routes(db, User):
+# Pagination defaults for GET /users/
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+STREAM_BATCH_SIZE = 500
+
+# Limits for GET /users/search
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MIN_SEARCH_LENGTH = 2
+MAX_SEARCH_LENGTH = 100
+
+def encode_cursor(last_id):
+    """Encode the last seen user id as an opaque pagination cursor"""
+    return base64.urlsafe_b64encode(json.dumps({'id': last_id}).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Decode a pagination cursor, raising ValueError if it is malformed"""
+    try:
+        last_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))['id']
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(last_id, int):
+        raise ValueError('Invalid cursor')
+    return last_id
+
+def create_routes(db, User, user_cache=None, profile_versions=None, login_throttle=None, payload_cache=None,
+                  login_activity=None, job_queue=None, user_search=None, shard_router=None):
     """Create route blueprints"""
+    def issue_token(user):
+        """Create an access token, embedding the profile snapshot when enabled"""
+        if profile_versions is None:
+            return create_access_token(identity=user.id)
+        return create_access_token(identity=user.id, additional_claims=profile_claims(user))
+
+    def load_user(user_id):
+        """Load a user's public fields, served from the user cache when enabled"""
+        def loader():
+            user = User.query.get(user_id)
+            return user.to_dict() if user else None
+
+        if user_cache is None:
+            return loader()
+        return user_cache.get_or_load(int(user_id), loader)
+
     # Create blueprints
     auth_bp = Blueprint('auth', __name__)
     user_bp = Blueprint('users', __name__)
 
+    def parse_registration(data):
+        """Validate a registration payload, returning (fields, error message)"""
+        # Validate required fields
+        required_fields = ['username', 'email', 'password']
+        for field in required_fields:
+            if not isinstance(data, dict) or field not in data:
+                return None, f'Missing required field: {field}'
+        
+        username = data['username'].strip()
+        email = data['email'].strip().lower()
+        password = data['password']
+        first_name = (data.get('first_name') or '').strip()
+        last_name = (data.get('last_name') or '').strip()
+        
+        # Validate input data
+        if not User.validate_username(username):
+            return None, 'Invalid username format'
+        
+        if not User.validate_email(email):
+            return None, 'Invalid email format'
+        
+        is_valid, message = User.validate_password(password)
+        if not is_valid:
+            return None, message
+        
+        return {
+            'username': username,
+            'email': email,
+            'password': password,
+            'first_name': first_name if first_name else None,
+            'last_name': last_name if last_name else None
+        }, None
+
     # Authentication Routes
     @auth_bp.route('/register', methods=['POST'])
     def register():
@@ -29,61 +115,119 @@ def create_routes(db, User):
         try:
             data = request.get_json()
             
-            # Validate required fields
-            required_fields = ['username', 'email', 'password']
-            for field in required_fields:
-                if not data or field not in data:
-                    return jsonify({'error': f'Missing required field: {field}'}), 400
-            
-            username = data['username'].strip()
-            email = data['email'].strip().lower()
-            password = data['password']
-            first_name = data.get('first_name', '').strip()
-            last_name = data.get('last_name', '').strip()
-            
-            # Validate input data
-            if not User.validate_username(username):
-                return jsonify({'error': 'Invalid username format'}), 400
-            
-            if not User.validate_email(email):
-                return jsonify({'error': 'Invalid email format'}), 400
-            
-            is_valid, message = User.validate_password(password)
-            if not is_valid:
-                return jsonify({'error': message}), 400
-            
-            # Check if user already exists
-            if User.query.filter_by(username=username).first():
-                return jsonify({'error': 'Username already exists'}), 409
-            
-            if User.query.filter_by(email=email).first():
-                return jsonify({'error': 'Email already exists'}), 409
-            
-            # Create new user
-            user = User(
-                username=username,
-                email=email,
-                password=password,
-                first_name=first_name if first_name else None,
-                last_name=last_name if last_name else None
-            )
-            
-            db.session.add(user)
+            fields, error = parse_registration(data)
+            if error:
+                return jsonify({'error': error}), 400
+            
+            # Create new user; the unique indexes reject duplicates on insert
+            user = User(**fields)
+            
+            try:
+                db.session.add(user)
+                db.session.flush()
+            except IntegrityError:
+                db.session.rollback()
+                conflict = User.find_conflict(fields['username'], fields['email'])
+                return jsonify({'error': conflict or 'User already exists'}), 409
+            
+            # Serialize before commit expires the instance, saving a reload query
+            user_data = user.to_dict()
+            access_token = issue_token(user)
+            if job_queue is not None:
+                job_queue.enqueue('user.registered', {'user_id': user.id, 'username': user.username})
             db.session.commit()
             
-            # Create access token
-            access_token = create_access_token(identity=user.id)
-            
             return jsonify({
                 'message': 'User registered successfully',
-                'user': user.to_dict(),
+                'user': user_data,
                 'access_token': access_token
             }), 201
             
+        except PasswordPoolFull:
+            # Handled by the app-level 503 handler
+            raise
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': 'Registration failed'}), 500
 
+    @auth_bp.route('/register/batch', methods=['POST'])
+    @jwt_required()
+    def register_batch():
+        """
+        Register many users in one transaction
+        Expected JSON: {"users": [<register payload>, ...]}
+        Returns one result per item, in order, with status
+        "created", "invalid" or "conflict".
+        """
+        try:
+            data = request.get_json()
+            items = data.get('users') if isinstance(data, dict) else None
+            if not isinstance(items, list) or not items:
+                return jsonify({'error': 'Expected a non-empty "users" array'}), 400
+            
+            max_batch = current_app.config.get('REGISTER_BATCH_MAX', 10000)
+            if len(items) > max_batch:
+                return jsonify({'error': f'Batch exceeds {max_batch} users'}), 413
+            
+            results = [None] * len(items)
+            accepted = []
+            for index, item in enumerate(items):
+                try:
+                    fields, error = parse_registration(item)
+                except (AttributeError, TypeError):
+                    fields, error = None, 'Invalid field types'
+                if error:
+                    results[index] = {'index': index, 'status': 'invalid', 'error': error}
+                else:
+                    accepted.append((index, fields))
+            
+            # One IN (...) query per unique lookup column
+            usernames = {User.normalize(fields['username']) for _, fields in accepted}
+            emails = {User.normalize(fields['email']) for _, fields in accepted}
+            taken_usernames = {row[0] for row in db.session.query(User.username_lower).filter(User.username_lower.in_(usernames))} if usernames else set()
+            taken_emails = {row[0] for row in db.session.query(User.email_lower).filter(User.email_lower.in_(emails))} if emails else set()
+            
+            pending = []
+            for index, fields in accepted:
+                username_key = User.normalize(fields['username'])
+                email_key = User.normalize(fields['email'])
+                if username_key in taken_usernames:
+                    results[index] = {'index': index, 'status': 'conflict', 'error': 'Username already exists'}
+                elif email_key in taken_emails:
+                    results[index] = {'index': index, 'status': 'conflict', 'error': 'Email already exists'}
+                else:
+                    # Later duplicates within the same batch conflict with the first
+                    taken_usernames.add(username_key)
+                    taken_emails.add(email_key)
+                    pending.append((index, fields))
+            
+            password_hashes = User.hash_passwords([fields.pop('password') for _, fields in pending])
+            users = [
+                User(password_hash=password_hash, **fields)
+                for (_, fields), password_hash in zip(pending, password_hashes)
+            ]
+            
+            db.session.add_all(users)
+            db.session.flush()
+            for (index, _), user in zip(pending, users):
+                results[index] = {'index': index, 'status': 'created', 'id': user.id, 'username': user.username}
+                if job_queue is not None:
+                    job_queue.enqueue('user.registered', {'user_id': user.id, 'username': user.username})
+            db.session.commit()
+            
+            return jsonify({
+                'created': len(users),
+                'failed': len(items) - len(users),
+                'results': results
+            }), 200
+            
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'error': 'Batch conflicted with concurrent registrations, please retry'}), 409
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': 'Batch registration failed'}), 500
+
     @auth_bp.route('/login', methods=['POST'])
     def login():
         """
@@ -106,21 +250,32 @@ def create_routes(db, User):
             if not identifier or not password:
                 return jsonify({'error': 'Username/email and password are required'}), 400
             
-            # Find user by username or email
-            user = None
-            if '@' in identifier:
-                user = User.query.filter_by(email=identifier.lower()).first()
-            else:
-                user = User.query.filter_by(username=identifier).first()
+            # Rate limit before any DB or bcrypt work
+            if login_throttle is not None:
+                login_throttle.check(request.remote_addr, identifier)
             
-            if not user or not user.verify_password(password):
+            # Find user by username or email through the lowercase indexes
+            user = User.find_by_identifier(identifier)
+            
+            if not user:
+                return jsonify({'error': 'Invalid credentials'}), 401
+            
+            # Outcomes are buffered and written in batches, never committed here
+            if not user.verify_password(password):
+                if login_activity is not None:
+                    login_activity.record(user.id, False, shard=shard_of(user))
                 return jsonify({'error': 'Invalid credentials'}), 401
             
             if not user.is_active:
+                if login_activity is not None:
+                    login_activity.record(user.id, False, shard=shard_of(user))
                 return jsonify({'error': 'Account is deactivated'}), 401
             
+            if login_activity is not None:
+                login_activity.record(user.id, True, request.remote_addr, shard=shard_of(user))
+            
             # Create access token
-            access_token = create_access_token(identity=user.id)
+            access_token = issue_token(user)
             
             return jsonify({
                 'message': 'Login successful',
@@ -128,70 +283,205 @@ def create_routes(db, User):
                 'access_token': access_token
             }), 200
             
+        except (PasswordPoolFull, LoginThrottled):
+            # Handled by the app-level 503/429 handlers
+            raise
         except Exception as e:
             return jsonify({'error': 'Login failed'}), 500
 
     @auth_bp.route('/profile', methods=['GET'])
     @jwt_required()
+    @read_only
     def get_profile():
         """Get current user profile"""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.get(user_id)
+            # Answer from the token's profile snapshot while it is current
+            user = None
+            if profile_versions is not None:
+                user = read_profile_claims(get_jwt(), profile_versions)
+            
+            if user is None:
+                user_id = get_jwt_identity()
+                user = load_user(user_id)
             
             if not user:
                 return jsonify({'error': 'User not found'}), 404
             
-            return jsonify({
-                'user': user.to_dict()
-            }), 200
+            # Unchanged since the client's copy: answer 304 without serializing
+            etag = user_etag(user)
+            return not_modified(etag) or tag_response(jsonify({
+                'user': user
+            }), etag)
             
         except Exception as e:
             return jsonify({'error': 'Failed to retrieve profile'}), 500
 
+    def stream_users(users):
+        """Yield a {"users": [...]} document in chunks from an iterable fetching rows in batches"""
+        yield '{"users":['
+        separator = ''
+        for user in users:
+            yield separator + user_fragment(user, payload_cache)
+            separator = ','
+        yield ']}'
+
     # User Management Routes
     @user_bp.route('/', methods=['GET'])
     @jwt_required()
+    @read_only
     def get_users():
-        """Get all users (admin only)"""
+        """
+        Get users ordered by id (admin only)
+        Query params:
+            limit: page size (default 100, max 1000)
+            cursor: opaque cursor from a previous page's "next"
+            stream: "true" to stream every user after the cursor as one JSON document
+        """
         try:
             current_user_id = get_jwt_identity()
-            current_user = User.query.get(current_user_id)
+            current_user = load_user(current_user_id)
             
             # Simple admin check (you might want to add an admin field to User model)
             if not current_user:
                 return jsonify({'error': 'User not found'}), 404
             
-            users = User.query.all()
-            return jsonify({
-                'users': [user.to_dict() for user in users]
-            }), 200
+            try:
+                after_id = decode_cursor(request.args['cursor']) if 'cursor' in request.args else 0
+                limit = int(request.args.get('limit', DEFAULT_PAGE_LIMIT))
+            except ValueError:
+                return jsonify({'error': 'Invalid pagination parameters'}), 400
+            
+            if limit < 1:
+                return jsonify({'error': 'Invalid pagination parameters'}), 400
+            limit = min(limit, MAX_PAGE_LIMIT)
+            
+            query = User.query.filter(User.id > after_id).order_by(User.id)
+            stream = request.args.get('stream', '').lower() == 'true'
+            users = None
+            
+            # Fingerprint the rows this response covers (the extra row included)
+            # and its shape, and answer 304 if the client already has them
+            shape = {'after_id': after_id, 'limit': limit, 'stream': stream}
+            if shard_router is None:
+                window = (query if stream else query.limit(limit + 1)).with_entities(
+                    User.id, User.updated_at
+                ).subquery()
+                etag = collection_etag(*db.session.query(
+                    func.count(), func.max(window.c.id), func.max(window.c.updated_at)
+                ).one(), **shape)
+            elif stream:
+                etag = collection_etag(*shard_router.window_stats(after_id), **shape)
+            else:
+                # Shards are read in parallel and merged by id; the page itself is the fingerprint
+                users = shard_router.page(after_id, limit + 1)
+                etag = collection_etag(
+                    len(users),
+                    users[-1].id if users else None,
+                    max((user.updated_at for user in users if user.updated_at), default=None),
+                    **shape
+                )
+            cached = not_modified(etag)
+            if cached is not None:
+                return cached
+            
+            if stream:
+                if shard_router is None:
+                    rows = query.yield_per(STREAM_BATCH_SIZE)
+                else:
+                    rows = shard_router.iter_users(after_id, STREAM_BATCH_SIZE)
+                return tag_response(Response(
+                    stream_with_context(stream_users(rows)),
+                    mimetype='application/json'
+                ), etag)
+            
+            # Fetch one extra row to know whether another page exists
+            if users is None:
+                users = query.limit(limit + 1).all()
+            has_more = len(users) > limit
+            users = users[:limit]
+            
+            # Assemble the body from per-user JSON fragments, reused while unchanged
+            next_cursor = encode_cursor(users[-1].id) if has_more else None
+            body = '{"next":%s,"users":[%s]}' % (
+                json.dumps(next_cursor),
+                ','.join(user_fragment(user, payload_cache) for user in users)
+            )
+            return tag_response(Response(body, status=200, mimetype='application/json'), etag)
             
         except Exception as e:
             return jsonify({'error': 'Failed to retrieve users'}), 500
 
+    @user_bp.route('/search', methods=['GET'])
+    @jwt_required()
+    @read_only
+    def search_users():
+        """
+        Search users (admin only), ordered by id
+        Query params:
+            q: username or email prefix, or words starting first/last names
+            limit: page size (default 20, max 100)
+            cursor: opaque cursor from a previous page's "next"
+        """
+        try:
+            current_user_id = get_jwt_identity()
+            current_user = load_user(current_user_id)
+            
+            if not current_user:
+                return jsonify({'error': 'User not found'}), 404
+            
+            q = request.args.get('q', '').strip()
+            if not MIN_SEARCH_LENGTH <= len(q) <= MAX_SEARCH_LENGTH:
+                return jsonify({
+                    'error': f'Query must be {MIN_SEARCH_LENGTH}-{MAX_SEARCH_LENGTH} characters'
+                }), 400
+            
+            try:
+                after_id = decode_cursor(request.args['cursor']) if 'cursor' in request.args else 0
+                limit = int(request.args.get('limit', DEFAULT_SEARCH_LIMIT))
+            except ValueError:
+                return jsonify({'error': 'Invalid pagination parameters'}), 400
+            
+            if limit < 1:
+                return jsonify({'error': 'Invalid pagination parameters'}), 400
+            limit = min(limit, MAX_SEARCH_LIMIT)
+            
+            try:
+                users = user_search.search(q, after_id, limit + 1)
+            except SearchTimeout:
+                return jsonify({'error': 'Search took too long, try a more specific query'}), 503
+            
+            has_more = len(users) > limit
+            users = users[:limit]
+            next_cursor = encode_cursor(users[-1].id) if has_more else None
+            body = '{"next":%s,"users":[%s]}' % (
+                json.dumps(next_cursor),
+                ','.join(user_fragment(user, payload_cache) for user in users)
+            )
+            return Response(body, status=200, mimetype='application/json')
+            
+        except Exception as e:
+            return jsonify({'error': 'Failed to search users'}), 500
+
     @user_bp.route('/<int:user_id>', methods=['GET'])
     @jwt_required()
+    @read_only
     def get_user(user_id):
         """Get specific user by ID"""
         try:
             current_user_id = get_jwt_identity()
-            current_user = User.query.get(current_user_id)
+            current_user = load_user(current_user_id)
             
             if not current_user:
                 return jsonify({'error': 'User not found'}), 404
             
             # Users can only view their own profile or if they're admin
-            if current_user.id != user_id:
+            if current_user['id'] != user_id:
                 return jsonify({'error': 'Access denied'}), 403
             
-            user = User.query.get(user_id)
-            if not user:
-                return jsonify({'error': 'User not found'}), 404
-            
-            return jsonify({
-                'user': user.to_dict()
-            }), 200
+            etag = user_etag(current_user)
+            return not_modified(etag) or tag_response(jsonify({
+                'user': current_user
+            }), etag)
             
         except Exception as e:
             return jsonify({'error': 'Failed to retrieve user'}), 500
@@ -234,19 +524,31 @@ def create_routes(db, User):
                 if not User.validate_email(new_email):
                     return jsonify({'error': 'Invalid email format'}), 400
                 
-                # Check if email is already taken by another user
-                existing_user = User.query.filter_by(email=new_email).first()
-                if existing_user and existing_user.id != current_user.id:
-                    return jsonify({'error': 'Email already exists'}), 409
-                
                 current_user.email = new_email
             
-            db.session.commit()
+            # The unique email index rejects addresses taken by another user
+            try:
+                db.session.flush()
+            except IntegrityError:
+                db.session.rollback()
+                return jsonify({'error': 'Email already exists'}), 409
             
-            return jsonify({
+            # Serialize before commit expires the instance, saving a reload query
+            response = {
                 'message': 'User updated successfully',
                 'user': current_user.to_dict()
-            }), 200
+            }
+            
+            # Hand back a token whose profile snapshot reflects the update
+            if profile_versions is not None:
+                response['access_token'] = issue_token(current_user)
+            
+            if job_queue is not None:
+                changed = sorted(field for field in ('first_name', 'last_name', 'email') if field in data)
+                job_queue.enqueue('user.updated', {'user_id': current_user.id, 'fields': changed})
+            db.session.commit()
+            
+            return jsonify(response), 200
             
         except Exception as e:
             db.session.rollback()
@@ -267,6 +569,9 @@ def create_routes(db, User):
             if current_user.id != user_id:
                 return jsonify({'error': 'Access denied'}), 403
             
+            # Only the row delete happens here; follow-up cleanup runs after commit
+            if job_queue is not None:
+                job_queue.enqueue('user.deleted', {'user_id': current_user.id, 'username': current_user.username})
             db.session.delete(current_user)
             db.session.commit()
             
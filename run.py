@@ -2,17 +2,236 @@
 """
 Flask Application Startup Script
 Simple script to run the Flask application with proper configuration.
+
+Development (single process, Werkzeug reloader/debugger):
+    python run.py
+
+Production (pre-forked workers sharing the preloaded app):
+    python run.py --workers 4 --max-requests 10000 [--reuse-port]
 """
 
+import argparse
 import os
+import shutil
+import signal
+import socket
 import sys
-from app import app, db
+import tempfile
+import threading
+import time
+from werkzeug.serving import make_server
+from app import close_app, create_app
+from metrics import clear_shared_metrics
+
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description='Run the Flask application.')
+    parser.add_argument('--host', default=os.getenv('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_CONCURRENCY', 0)),
+                        help='Number of worker processes; 0 runs the development server')
+    parser.add_argument('--threads', type=int, default=int(os.getenv('WORKER_THREADS', 1)),
+                        help='Serve each worker with a thread per request when greater than 1')
+    parser.add_argument('--reuse-port', action='store_true', default=os.getenv('REUSE_PORT') == 'true',
+                        help='Give each worker its own SO_REUSEPORT listener')
+    parser.add_argument('--max-requests', type=int, default=int(os.getenv('MAX_REQUESTS', 0)),
+                        help='Recycle a worker after this many requests (0 = never)')
+    parser.add_argument('--graceful-timeout', type=float, default=float(os.getenv('GRACEFUL_TIMEOUT', 30)),
+                        help='Seconds workers get to finish in-flight requests on shutdown')
+    parser.add_argument('--backlog', type=int, default=2048)
+    return parser.parse_args()
+
+
+def release_connections(app):
+    """Drop pooled connections so forked workers open their own"""
+    with app.app_context():
+        for engine in app.extensions['sqlalchemy'].engines.values():
+            engine.dispose()
+
+
+def report_startup(app):
+    """Print how long building the app took and what the schema check did"""
+    startup = app.extensions['startup']
+    print(f"✅ App ready in {startup['startup_ms']:.0f}ms "
+          f"(imports {startup['import_ms']:.0f}ms, schema {startup['schema']})")
+
+
+def create_listener(host, port, backlog, reuse_port=False):
+    """Create a bound, listening TCP socket"""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class WorkerApp:
+    """WSGI middleware tracking in-flight requests and recycling after max_requests"""
+
+    def __init__(self, wsgi_app, max_requests=0, on_limit=None):
+        self.wsgi_app = wsgi_app
+        self.max_requests = max_requests
+        self.on_limit = on_limit
+        self.count = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.count += 1
+            self.in_flight += 1
+            reached = self.count == self.max_requests
+        if reached:
+            self.on_limit()
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def drain(self, timeout):
+        """Wait up to timeout seconds for in-flight requests to finish"""
+        deadline = time.monotonic() + timeout
+        while self.in_flight and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+
+def run_worker(app, options, listener):
+    """Serve requests in a forked worker until told to stop or recycled"""
+    if listener is None:
+        listener = create_listener(options.host, options.port, options.backlog, reuse_port=True)
+
+    stopping = threading.Event()
+    server = None
+
+    def stop(*_):
+        # shutdown() blocks until serve_forever returns, so call it off the serving thread
+        if not stopping.is_set():
+            stopping.set()
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+    worker_app = WorkerApp(app, options.max_requests, stop)
+    server = make_server(
+        options.host, options.port, worker_app,
+        threaded=options.threads > 1,
+        fd=listener.fileno()
+    )
+    # Workers share the listener: a sibling may win the connection after select()
+    # wakes us, so accept() must not block or shutdown() would wait for the next client
+    server.socket.setblocking(False)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server.serve_forever()
+
+    # Stop accepting, then let threaded requests finish before exiting
+    listener.close()
+    worker_app.drain(options.graceful_timeout)
+
+    # os._exit() skips atexit, so flush buffered writes here
+    close_app(app)
+
+
+def serve_production(app, options):
+    """Pre-fork master: workers inherit the preloaded app, then get supervised"""
+    if not hasattr(os, 'fork'):
+        print("❌ Multi-process mode requires a POSIX system")
+        sys.exit(1)
+
+    release_connections(app)
+
+    # With SO_REUSEPORT each worker binds its own socket and the kernel balances connections
+    listener = None if options.reuse_port else create_listener(options.host, options.port, options.backlog)
+    workers = {}
+    shutting_down = False
+    shared_metrics = app.extensions.get('shared_metrics')
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                run_worker(app, options, listener)
+                status = 0
+            finally:
+                # Never fall back into the master's loop
+                os._exit(status)
+        workers[pid] = time.monotonic()
+
+    def shutdown(*_):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    print(f"🚀 Serving on http://{options.host}:{options.port} with {options.workers} workers (master pid {os.getpid()})")
+    for _ in range(options.workers):
+        spawn()
+
+    deadline = None
+    while workers:
+        if shutting_down and deadline is None:
+            deadline = time.monotonic() + options.graceful_timeout
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG if deadline else 0)
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        if pid:
+            workers.pop(pid, None)
+            if shared_metrics is not None:
+                # Keep the exited worker's counts without keeping its file
+                shared_metrics.retire(pid)
+            if not shutting_down:
+                # Recycled or crashed worker: replace it
+                spawn()
+        elif deadline and time.monotonic() > deadline:
+            for pid in list(workers):
+                os.kill(pid, signal.SIGKILL)
+        else:
+            time.sleep(0.1)
+
+    print("\n🛑 Application stopped")
+
 
 def main():
     """Main startup function"""
+    options = parse_args()
+
     print("🚀 Starting Flask Application...")
     print("=" * 50)
-    
+
+    temporary_metrics_dir = None
+    if options.workers > 0:
+        # Workers share their metrics through snapshot files so any of them can answer /metrics
+        if not os.getenv('METRICS_DIR'):
+            temporary_metrics_dir = os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='metrics-')
+        clear_shared_metrics(os.environ['METRICS_DIR'])
+
+    try:
+        # Builds the app and creates tables only if the schema stamp is out of date
+        app = create_app()
+        report_startup(app)
+
+        if options.workers > 0:
+            serve_production(app, options)
+            return
+    finally:
+        if temporary_metrics_dir is not None:
+            shutil.rmtree(temporary_metrics_dir, ignore_errors=True)
+
     # Check if we're in development mode
     if os.getenv('FLASK_ENV') == 'development':
         print("📝 Development mode enabled")
@@ -20,20 +239,15 @@ def main():
         print("🌐 Server will be accessible at: http://localhost:5000")
         print("📊 API documentation: http://localhost:5000/api")
         print("=" * 50)
-    
+
     try:
-        # Create database tables
-        with app.app_context():
-            db.create_all()
-            print("✅ Database initialized successfully")
-        
         # Run the application
         app.run(
-            host='0.0.0.0',
-            port=int(os.getenv('PORT', 5000)),
+            host=options.host,
+            port=options.port,
             debug=os.getenv('FLASK_ENV') == 'development'
         )
-        
+
     except KeyboardInterrupt:
         print("\n🛑 Application stopped by user")
         sys.exit(0)
@@ -42,4 +256,4 @@ def main():
         sys.exit(1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,188 @@
+"""
+User Search
+Case-insensitive prefix search on username and email over their indexed
+lowercase lookup columns, and
+full-text search on first and last name through an SQLite FTS5 index kept
+in sync with the users table by triggers. Results are ordered by id so
+pages use the same cursors as GET /users/, and each query runs under a
+latency budget. With sharding every shard is searched and the ids merged.
+"""
+
+import logging
+import re
+import time
+from contextlib import contextmanager
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'users_search'
+
+# External-content FTS5 table: it stores only the index, the names stay in users
+SEARCH_DDL = (
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        first_name, last_name, content='users', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ai AFTER INSERT ON users BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, first_name, last_name)
+        VALUES (new.id, new.first_name, new.last_name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ad AFTER DELETE ON users BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, first_name, last_name)
+        VALUES ('delete', old.id, old.first_name, old.last_name);
+    END""",
+    # Only name changes touch the index; login activity updates do not
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_au AFTER UPDATE OF first_name, last_name ON users BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, first_name, last_name)
+        VALUES ('delete', old.id, old.first_name, old.last_name);
+        INSERT INTO {SEARCH_TABLE}(rowid, first_name, last_name)
+        VALUES (new.id, new.first_name, new.last_name);
+    END""",
+)
+
+# Upper bound for prefix range scans: sorts after any string starting with the prefix
+PREFIX_END = '\U0010ffff'
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchTimeout(Exception):
+    """Raised when a search query runs past its latency budget"""
+
+
+def ensure_search_index(engine):
+    """
+    Create the FTS5 table and its triggers if missing, indexing existing users.
+    Returns False when the database cannot host it (not SQLite, or no FTS5).
+    """
+    if engine.dialect.name != 'sqlite':
+        return False
+    try:
+        with engine.begin() as connection:
+            exists = connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': SEARCH_TABLE}
+            ).first()
+            if exists is None:
+                for statement in SEARCH_DDL:
+                    connection.execute(text(statement))
+                connection.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')"))
+    except OperationalError:
+        logger.warning('FTS5 is unavailable, name search falls back to LIKE prefix matching')
+        return False
+    return True
+
+
+def rebuild_search_index(engine):
+    """Re-index every user from the users table"""
+    with engine.begin() as connection:
+        connection.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')"))
+
+
+def fts_query(q):
+    """Turn free text into an FTS5 query where every word is a quoted prefix"""
+    return ' '.join(f'"{word}"*' for word in WORD.findall(q))
+
+
+def like_prefix(q):
+    """Escape q for a LIKE prefix pattern"""
+    return q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+@contextmanager
+def latency_budget(connection, deadline):
+    """Abort SQLite statements on connection still running at deadline (a perf_counter value)"""
+    driver = connection.connection.driver_connection
+    if deadline is None or not hasattr(driver, 'set_progress_handler'):
+        yield
+        return
+    # A non-zero return from the handler interrupts the running statement
+    driver.set_progress_handler(lambda: time.perf_counter() > deadline, 1000)
+    try:
+        yield
+    except OperationalError as error:
+        if 'interrupted' in str(error.orig):
+            raise SearchTimeout() from error
+        raise
+    finally:
+        driver.set_progress_handler(None, 0)
+
+
+class UserSearch:
+    """Finds user ids by username/email prefix or by words in their names"""
+
+    def __init__(self, db, User, fts=True, budget_ms=250, shard_router=None):
+        self.db = db
+        self.User = User
+        self.fts = fts
+        self.budget_ms = budget_ms
+        self.shard_router = shard_router
+        self.table = User.__tablename__
+
+    def engines(self):
+        """Shard id -> engine of every database holding users"""
+        if self.shard_router is None:
+            return {None: self.db.engine}
+        return self.shard_router.engines()
+
+    def ensure_index(self):
+        """Create the FTS5 index if needed; falls back to LIKE matching without it"""
+        self.fts = all([ensure_search_index(engine) for engine in self.engines().values()])
+        return self.fts
+
+    def _statement(self, has_words):
+        # The unary + keeps the planner on the lookup indexes rather than the id range
+        branches = [
+            f'SELECT id FROM {self.table} WHERE username_lower >= :prefix AND username_lower < :prefix_end AND +id > :after',
+            f'SELECT id FROM {self.table} WHERE email_lower >= :prefix AND email_lower < :prefix_end AND +id > :after',
+        ]
+        if self.fts:
+            if has_words:
+                branches.append(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match AND rowid > :after')
+        else:
+            branches.append(
+                f"SELECT id FROM {self.table} WHERE (first_name LIKE :name ESCAPE '\\' "
+                f"OR last_name LIKE :name ESCAPE '\\') AND id > :after"
+            )
+        return text(' UNION '.join(branches) + ' ORDER BY 1 LIMIT :limit')
+
+    def search_ids(self, q, after_id=0, limit=20):
+        """Ids of matching users after after_id, ascending, at most limit"""
+        match = fts_query(q)
+        prefix = self.User.normalize(q)
+        params = {
+            'prefix': prefix, 'prefix_end': prefix + PREFIX_END,
+            'match': match, 'name': like_prefix(q),
+            'after': after_id, 'limit': limit
+        }
+        statement = self._statement(bool(match))
+        deadline = time.perf_counter() + self.budget_ms / 1000.0 if self.budget_ms else None
+        if self.shard_router is None:
+            connections = [self.db.session.connection()]
+        else:
+            connections = [self.db.session.connection(bind_arguments={'shard_id': shard})
+                           for shard in self.shard_router.read_shards()]
+
+        ids = []
+        for connection in connections:
+            with latency_budget(connection, deadline):
+                ids.extend(connection.execute(statement, params).scalars())
+        return sorted(ids)[:limit]
+
+    def search(self, q, after_id=0, limit=20):
+        """Matching users after after_id in id order, at most limit"""
+        ids = self.search_ids(q, after_id, limit)
+        if not ids:
+            return []
+        # Sharded results arrive shard by shard, so order them here
+        return sorted(self.User.query.filter(self.User.id.in_(ids)), key=lambda user: user.id)
+
+
+def create_user_search(app, db, User, shard_router=None):
+    """Build the searcher; the index itself is created by ensure_index() once tables exist"""
+    with app.app_context():
+        fts = db.engine.dialect.name == 'sqlite'
+    return UserSearch(db, User, fts=fts, budget_ms=app.config.get('SEARCH_BUDGET_MS', 250),
+                      shard_router=shard_router)
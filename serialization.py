@@ -0,0 +1,81 @@
+"""
+JSON Serialization
+Fast JSON provider backed by orjson when it is installed, and a cache of
+serialized user payloads keyed by (id, updated_at).
+"""
+
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+from cache import LRUCache
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes with orjson and falls back to the default hook"""
+
+    def dumps(self, obj, **kwargs):
+        return self._dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps_bytes(obj), mimetype=self.mimetype)
+
+    def _dumps_bytes(self, obj):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+
+def configure_json(app):
+    """Install the fastest available JSON provider unless JSON_PROVIDER is 'default'"""
+    if orjson is not None and app.config.get('JSON_PROVIDER', 'orjson') == 'orjson':
+        app.json = OrjsonProvider(app)
+
+
+class PayloadCache:
+    """
+    Serialized user JSON keyed by (id, updated_at). Any write bumps
+    updated_at, so stale fragments are never looked up again and simply
+    age out of the LRU.
+    """
+
+    def __init__(self, maxsize=50000):
+        self._cache = LRUCache(maxsize=maxsize, ttl=float('inf'))
+
+    def fragment(self, user):
+        """Return the user's to_dict() as a JSON string, reusing a cached copy"""
+        key = (user.id, user.updated_at)
+        payload = self._cache.get(key)
+        if payload is None:
+            payload = current_app.json.dumps(user.to_dict())
+            self._cache.set(key, payload)
+        return payload
+
+    def stats(self):
+        """Return hit/miss counters"""
+        stats = self._cache.stats()
+        stats.pop('ttl', None)
+        return stats
+
+
+def create_payload_cache(config):
+    """Create the payload cache from app config, or None when PAYLOAD_CACHE_SIZE is 0"""
+    maxsize = config.get('PAYLOAD_CACHE_SIZE', 50000)
+    if not maxsize:
+        return None
+    return PayloadCache(maxsize=maxsize)
+
+
+def user_fragment(user, payload_cache=None):
+    """Serialize a user to JSON, through the payload cache when available"""
+    if payload_cache is None:
+        return current_app.json.dumps(user.to_dict())
+    return payload_cache.fragment(user)
@@ -0,0 +1,427 @@
+"""
+User Sharding
+Optional hash partitioning of the users table across the databases listed in
+SHARD_DATABASE_URLS. A user lives on the shard picked by rendezvous hashing
+of the normalized username, so adding a shard moves only the users that now
+hash to it. The primary database keeps a small directory of id, username,
+email and shard: it hands out globally unique ids, keeps usernames and emails
+unique across shards and routes id, username and email lookups, so users
+not yet moved after a shard is added are still found where they are.
+Queries that cannot be routed go to every shard; GET /users/ reads all
+shards in parallel and merges them by id.
+
+Users already in the primary's users table when sharding is switched on are
+entered in the directory as living on the primary. While any are left there,
+unrouted reads include the primary, so they stay listed until
+`flask users rebalance --include-primary` moves them.
+"""
+
+import hashlib
+import heapq
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Column, Index, Integer, MetaData, String, Table, bindparam, event, func, inspect, select, text
+from sqlalchemy.ext import horizontal_shard
+from sqlalchemy.orm import Session as PlainSession
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList
+
+from database import add_missing_columns, add_missing_indexes
+
+# Shard id of the primary database: home of the directory and of users not yet moved to a shard
+DIRECTORY = 'directory'
+
+# How often to check whether users from before sharding are still on the primary
+PRIMARY_USERS_RECHECK_SECONDS = 30
+
+directory_metadata = MetaData()
+user_directory = Table(
+    'user_directory', directory_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('email_lower', String(120), nullable=False, unique=True),
+    # Nullable only for directories created before usernames were recorded, until backfilled
+    Column('username_lower', String(80), nullable=True),
+    Column('shard', String(50), nullable=False),
+    Index('ix_user_directory_username_lower', 'username_lower', unique=True)
+)
+
+
+def shard_urls(config):
+    """The shard database URLs from SHARD_DATABASE_URLS, in order"""
+    return [url.strip() for url in config.get('SHARD_DATABASE_URLS', '').split(',') if url.strip()]
+
+
+def configure_sharding(config):
+    """Add one bind per shard (shard0, shard1, ...) to SQLALCHEMY_BINDS"""
+    urls = shard_urls(config)
+    if not urls:
+        return
+    if config.get('REPLICA_DATABASE_URL'):
+        raise ValueError('REPLICA_DATABASE_URL cannot be combined with SHARD_DATABASE_URLS')
+    binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+    binds.update({f'shard{index}': url for index, url in enumerate(urls)})
+    config['SQLALCHEMY_BINDS'] = binds
+
+
+def sharded_session_options(config):
+    """Session options for SQLAlchemy(): the sharded session when shards are configured"""
+    return {'class_': ShardedSession} if shard_urls(config) else {}
+
+
+def shard_of(user):
+    """The shard a loaded user came from, or None without sharding"""
+    return inspect(user).identity_token
+
+
+def _score(shard, key):
+    digest = hashlib.blake2b(f'{shard}:{key}'.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class ShardedSession(horizontal_shard.ShardedSession, Session):
+    """Flask-SQLAlchemy session routing users to shards via the app's ShardRouter"""
+
+    def __init__(self, db, **kwargs):
+        router = current_app.extensions['shard_router']
+        super().__init__(
+            shard_chooser=router.shard_chooser,
+            identity_chooser=router.identity_chooser,
+            execute_chooser=router.execute_chooser,
+            shards=router.engines(),
+            db=db,
+            **kwargs
+        )
+        event.listen(self, 'before_flush', router.before_flush)
+
+
+class ShardRouter:
+    """Places users on shards, routes queries and fans reads out across shards"""
+
+    def __init__(self, db, User, shards, rebalancing=False, fanout_workers=None):
+        self.db = db
+        self.User = User
+        self.table = User.__table__
+        self.shards = list(shards)
+        self.rebalancing = rebalancing
+        self.fanout_workers = fanout_workers or len(self.shards) + 1
+        self._primary_users = None
+        self._primary_checked_at = 0.0
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.routed = 0
+        self.fanned_out = 0
+
+    def engines(self):
+        """Shard id -> engine, including the directory on the primary"""
+        engines = {name: self.db.engines[name] for name in self.shards}
+        engines[DIRECTORY] = self.db.engine
+        return engines
+
+    def primary_has_users(self):
+        """
+        Whether users from before sharding are still on the primary. Once they
+        have all been moved none can return, so only a True answer is re-checked.
+        """
+        if self._primary_users is False:
+            return False
+        now = time.monotonic()
+        if self._primary_users is None or now - self._primary_checked_at >= PRIMARY_USERS_RECHECK_SECONDS:
+            with self.db.engine.connect() as connection:
+                self._primary_users = connection.execute(
+                    select(user_directory.c.id).where(user_directory.c.shard == DIRECTORY).limit(1)
+                ).first() is not None
+            self._primary_checked_at = now
+        return self._primary_users
+
+    def read_shards(self):
+        """Shards an unrouted read must visit, with the primary while it still holds users"""
+        return self.shards + ([DIRECTORY] if self.rebalancing or self.primary_has_users() else [])
+
+    def shard_for_username(self, username):
+        """Rendezvous hash of the normalized username over the configured shards"""
+        key = self.User.normalize(username)
+        return max(self.shards, key=lambda shard: _score(shard, key))
+
+    # Choosers for the sharded session
+
+    def shard_chooser(self, mapper, instance, clause=None, **kw):
+        if instance is not None and mapper is not None and mapper.local_table is self.table:
+            return self.shard_for_username(instance.username)
+        return DIRECTORY
+
+    def identity_chooser(self, mapper, primary_key, *, lazy_loaded_from=None, **kw):
+        if lazy_loaded_from is not None:
+            return [lazy_loaded_from.identity_token]
+        return self.shards + [DIRECTORY]
+
+    def execute_chooser(self, context):
+        mapper = context.bind_mapper
+        if mapper is None or mapper.local_table is not self.table:
+            return [DIRECTORY]
+        where = getattr(context.statement, 'whereclause', None)
+        shards = self._route(where, context.parameters or {}) if where is not None else None
+        if shards is None:
+            self.fanned_out += 1
+            return self.read_shards()
+        self.routed += 1
+        # Keep shard order stable so concatenated results are deterministic
+        return [shard for shard in self.shards + [DIRECTORY] if shard in shards]
+
+    def _route(self, clause, parameters):
+        """Shards that can hold rows matching clause, or None when any shard can"""
+        if isinstance(clause, BooleanClauseList):
+            routes = [self._route(child, parameters) for child in clause.clauses]
+            if clause.operator is operators.and_:
+                known = [shards for shards in routes if shards is not None]
+                return set.intersection(*known) if known else None
+            if clause.operator is operators.or_ and all(shards is not None for shards in routes):
+                return set().union(*routes)
+            return None
+        if not isinstance(clause, BinaryExpression) or not isinstance(clause.right, BindParameter):
+            return None
+        column = clause.left
+        if getattr(column, 'table', None) is not self.table:
+            return None
+        if clause.operator is operators.eq:
+            values = [self._bind_value(clause.right, parameters)]
+        elif clause.operator is operators.in_op:
+            values = list(self._bind_value(clause.right, parameters) or [])
+        else:
+            return None
+        if not values or any(value is None for value in values):
+            return None
+
+        if column.name == 'username_lower':
+            # Users not in the directory yet, like those flushed by the current transaction, are on their hash shard
+            return self._directory_lookup(column.name, values) | {self.shard_for_username(value) for value in values}
+        if column.name in ('id', 'email_lower'):
+            shards = self._directory_lookup(column.name, values)
+            # Directory rows written by the current transaction are not visible to the lookup yet
+            return shards or None
+        return None
+
+    @staticmethod
+    def _bind_value(bind, parameters):
+        value = bind.effective_value
+        return parameters.get(bind.key, value) if value is None else value
+
+    def _directory_lookup(self, column, values):
+        with self.db.engine.connect() as connection:
+            rows = connection.execute(
+                select(user_directory.c.shard).where(user_directory.c[column].in_(values)).distinct()
+            ).scalars().all()
+        return {shard for shard in rows if shard in self.shards or shard == DIRECTORY}
+
+    # Directory upkeep during flush
+
+    def before_flush(self, session, flush_context, instances):
+        """
+        Allocate ids for new users and mirror email changes and deletes in the
+        directory, whose unique usernames and emails reject duplicates on any shard.
+        """
+        new_users = [obj for obj in session.new if isinstance(obj, self.User)]
+        changed = [obj for obj in session.dirty if isinstance(obj, self.User)
+                   and inspect(obj).attrs.email_lower.history.has_changes()]
+        deleted = [obj for obj in session.deleted if isinstance(obj, self.User)]
+        if not (new_users or changed or deleted):
+            return
+
+        connection = session.connection(bind_arguments={'shard_id': DIRECTORY})
+        for user in new_users:
+            if user.id is None:
+                user.id = connection.execute(user_directory.insert().values(
+                    email_lower=user.email_lower, username_lower=user.username_lower,
+                    shard=self.shard_for_username(user.username)
+                )).inserted_primary_key[0]
+        for user in changed:
+            connection.execute(user_directory.update().where(user_directory.c.id == user.id).values(
+                email_lower=user.email_lower
+            ))
+        if deleted:
+            connection.execute(user_directory.delete().where(
+                user_directory.c.id.in_([user.id for user in deleted])
+            ))
+
+    # Parallel reads across shards
+
+    def _pool(self):
+        """Thread pool for fan-out reads, created per process (threads do not survive fork)"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(self.fanout_workers, thread_name_prefix='shard-fanout')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def fan_out(self, fn):
+        """Run fn(session) on every shard in parallel, each with its own session"""
+        # Resolve engines here: db.engines needs the app context the pool threads lack
+        engines = self.engines()
+
+        def run(shard):
+            with PlainSession(engines[shard]) as session:
+                return fn(session)
+        return list(self._pool().map(run, self.read_shards()))
+
+    def page(self, after_id, limit):
+        """Up to limit users with id > after_id in id order, merged from all shards"""
+        statement = select(self.User).where(self.User.id > after_id).order_by(self.User.id).limit(limit)
+        parts = self.fan_out(lambda session: session.scalars(statement).all())
+        return list(heapq.merge(*parts, key=attrgetter('id')))[:limit]
+
+    def window_stats(self, after_id):
+        """(row count, highest id, latest updated_at) of users with id > after_id"""
+        statement = select(func.count(), func.max(self.User.id), func.max(self.User.updated_at)).where(
+            self.User.id > after_id
+        )
+        parts = self.fan_out(lambda session: session.execute(statement).one())
+        return (
+            sum(part[0] for part in parts),
+            max((part[1] for part in parts if part[1] is not None), default=None),
+            max((part[2] for part in parts if part[2] is not None), default=None)
+        )
+
+    def iter_users(self, after_id, batch_size):
+        """Every user with id > after_id in id order, read from all shards in batches"""
+        engines = self.engines()
+        sessions = [PlainSession(engines[shard]) for shard in self.read_shards()]
+        try:
+            statement = select(self.User).where(self.User.id > after_id).order_by(self.User.id).execution_options(
+                yield_per=batch_size
+            )
+            yield from heapq.merge(*(session.scalars(statement) for session in sessions), key=attrgetter('id'))
+        finally:
+            for session in sessions:
+                session.close()
+
+    # Schema and rebalancing
+
+    def ensure_schema(self):
+        """
+        Create the directory on the primary and the users table on every shard,
+        and fill in usernames missing from a directory created without them.
+        """
+        primary = self.db.engine
+        inspector = inspect(primary)
+        if not inspector.has_table(user_directory.name):
+            directory_metadata.create_all(primary)
+            if inspector.has_table(self.table.name):
+                # Reserve the ids, usernames and emails of existing users, which stay on the primary for now
+                with primary.begin() as connection:
+                    connection.execute(text(
+                        f'INSERT INTO {user_directory.name} (id, email_lower, username_lower, shard) '
+                        f'SELECT id, email_lower, username_lower, :shard FROM {self.table.name}'
+                    ), {'shard': DIRECTORY})
+                self._primary_users = None
+        else:
+            add_missing_columns(primary, directory_metadata)
+        for shard in self.shards:
+            engine = self.db.engines[shard]
+            self.table.create(engine, checkfirst=True)
+            add_missing_columns(engine, self.table.metadata)
+        self._backfill_usernames()
+        add_missing_indexes(primary, directory_metadata)
+
+    def _backfill_usernames(self, batch_size=500):
+        """Copy username_lower into directory rows lacking it from the shard each row points to"""
+        engines = self.engines()
+        with self.db.engine.connect() as connection:
+            shards = connection.execute(select(user_directory.c.shard).where(
+                user_directory.c.username_lower.is_(None)
+            ).distinct()).scalars().all()
+        update = user_directory.update().where(
+            user_directory.c.id == bindparam('user_id'), user_directory.c.username_lower.is_(None)
+        ).values(username_lower=bindparam('username'))
+        for shard in shards:
+            if shard not in engines or not inspect(engines[shard]).has_table(self.table.name):
+                continue
+            last_id = 0
+            while True:
+                with engines[shard].connect() as connection:
+                    rows = connection.execute(select(self.table.c.id, self.table.c.username_lower).where(
+                        self.table.c.id > last_id
+                    ).order_by(self.table.c.id).limit(batch_size)).all()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                with self.db.engine.begin() as connection:
+                    connection.execute(update, [{'user_id': row[0], 'username': row[1]} for row in rows])
+
+    def rebalance(self, batch_size=500, dry_run=False, include_primary=False):
+        """
+        Move every user not on the shard its username hashes to. With
+        include_primary, users still in the primary's own users table (from
+        before sharding) are moved too. Returns {(source, target): count}.
+        """
+        sources = list(self.shards) + ([DIRECTORY] if include_primary else [])
+        engines = self.engines()
+        moved = {}
+        for source in sources:
+            last_id = 0
+            while True:
+                with engines[source].connect() as connection:
+                    rows = connection.execute(select(self.table).where(self.table.c.id > last_id).order_by(
+                        self.table.c.id
+                    ).limit(batch_size)).mappings().all()
+                if not rows:
+                    break
+                last_id = rows[-1]['id']
+
+                targets = {}
+                for row in rows:
+                    target = self.shard_for_username(row['username'])
+                    if target != source:
+                        targets.setdefault(target, []).append(dict(row))
+                for target, group in targets.items():
+                    if not dry_run:
+                        self._move(engines[source], engines[target], target, group)
+                    moved[(source, target)] = moved.get((source, target), 0) + len(group)
+        self._primary_users = None
+        return moved
+
+    def _move(self, source, target, shard, rows):
+        """Copy rows to the target shard, repoint the directory, then delete the originals"""
+        ids = [row['id'] for row in rows]
+        # Replacing any earlier partial copy makes an interrupted run safe to repeat
+        with target.begin() as connection:
+            connection.execute(self.table.delete().where(self.table.c.id.in_(ids)))
+            connection.execute(self.table.insert(), rows)
+        with self.db.engine.begin() as connection:
+            connection.execute(user_directory.delete().where(user_directory.c.id.in_(ids)))
+            connection.execute(user_directory.insert(), [
+                {'id': row['id'], 'email_lower': row['email_lower'], 'username_lower': row['username_lower'], 'shard': shard}
+                for row in rows
+            ])
+        with source.begin() as connection:
+            connection.execute(self.table.delete().where(self.table.c.id.in_(ids)))
+
+    def stats(self):
+        return {
+            'shards': len(self.shards),
+            'rebalancing': self.rebalancing,
+            'primary_has_users': self._primary_users,
+            'routed_queries': self.routed,
+            'fanned_out_queries': self.fanned_out
+        }
+
+
+def create_shard_router(app, db, User):
+    """Build the router for SHARD_DATABASE_URLS, or None when sharding is off"""
+    urls = shard_urls(app.config)
+    if not urls:
+        return None
+    router = ShardRouter(
+        db,
+        User,
+        [f'shard{index}' for index in range(len(urls))],
+        rebalancing=app.config.get('SHARD_REBALANCING', False),
+        fanout_workers=app.config.get('SHARD_FANOUT_WORKERS') or None
+    )
+    app.extensions['shard_router'] = router
+    return router
@@ -119,6 +119,27 @@ def test_update_profile(token):
         print(f"Error: {e}")
         return False
 
+def test_users_etag(token):
+    """Test that list ETags differ by page size and format"""
+    print("\nTesting users list ETags...")
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    try:
+        paged = requests.get(f"{BASE_URL}/users/?limit=1", headers=headers)
+        etag = paged.headers.get("ETag")
+        print(f"Status: {paged.status_code}, ETag: {etag}")
+        
+        # The same ETag is still current for the same request
+        repeat = requests.get(f"{BASE_URL}/users/?limit=1", headers={**headers, "If-None-Match": etag})
+        # But it must not validate a differently shaped body
+        streamed = requests.get(f"{BASE_URL}/users/?stream=true", headers={**headers, "If-None-Match": etag})
+        larger = requests.get(f"{BASE_URL}/users/?limit=2", headers={**headers, "If-None-Match": etag})
+        print(f"Same request: {repeat.status_code}, stream: {streamed.status_code}, limit=2: {larger.status_code}")
+        return repeat.status_code == 304 and streamed.status_code == 200 and larger.status_code == 200
+    except Exception as e:
+        print(f"Error: {e}")
+        return False
+
 def main():
     """Run all tests"""
     print("Starting API Tests...")
@@ -143,6 +164,7 @@ def main():
     if token:
         test_profile(token)
         test_update_profile(token)
+        test_users_etag(token)
     
     print("\n" + "=" * 50)
     print("Tests completed!")
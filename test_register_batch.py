@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Batch registration test
+Checks the per-item results of POST /auth/register/batch: invalid items,
+case-insensitive duplicates within the batch, conflicts with existing users
+and a batch racing a concurrent registration.
+"""
+
+import os
+import sys
+import tempfile
+
+# Add current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import event, text
+
+from app import close_app, create_app
+
+PASSWORD = 'SecurePass123'
+
+
+def build_app(directory):
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{directory}/app.db',
+        'BCRYPT_ROUNDS': 4,
+        'PASSWORD_POOL_WORKERS': 0,
+        'LOGIN_THROTTLE': False,
+        'JOBS_WORKERS': 0,
+        'REGISTER_BATCH_MAX': 10
+    })
+
+
+def user(username, email, password=PASSWORD):
+    return {'username': username, 'email': email, 'password': password}
+
+
+def register_batch(client, token, users):
+    return client.post('/auth/register/batch', json={'users': users}, headers={'Authorization': f'Bearer {token}'})
+
+
+def test_batch_results_per_item():
+    with tempfile.TemporaryDirectory() as directory:
+        app = build_app(directory)
+        client = app.test_client()
+        response = client.post('/auth/register', json=user('Existing', 'existing@example.com'))
+        assert response.status_code == 201
+        token = response.get_json()['access_token']
+
+        response = register_batch(client, token, [
+            user('alice', 'alice@example.com'),
+            user('ALICE', 'alice2@example.com'),          # username taken earlier in the batch
+            user('bob', 'Alice@Example.com'),             # email taken earlier in the batch
+            user('existing', 'new@example.com'),          # username of an existing user
+            user('carol', 'EXISTING@example.com'),        # email of an existing user
+            user('dave', 'dave@example.com', 'weak'),     # invalid password
+            {'username': 'erin'},                         # missing fields
+            user('frank', 'frank@example.com')
+        ])
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+        statuses = [result['status'] for result in body['results']]
+        assert statuses == ['created', 'conflict', 'conflict', 'conflict', 'conflict', 'invalid', 'invalid', 'created']
+        errors = [result.get('error') for result in body['results']]
+        assert errors[1:5] == ['Username already exists', 'Email already exists',
+                               'Username already exists', 'Email already exists']
+        assert [result['index'] for result in body['results']] == list(range(8))
+        assert (body['created'], body['failed']) == (2, 6)
+
+        # Created users can log in; nothing else was written
+        assert client.post('/auth/login', json={'username': 'ALICE', 'password': PASSWORD}).status_code == 200
+        assert client.post('/auth/login', json={'username': 'frank', 'password': PASSWORD}).status_code == 200
+        with app.app_context():
+            count = app.extensions['sqlalchemy'].session.execute(text('SELECT count(*) FROM users')).scalar()
+        assert count == 3
+
+        # Empty and oversized batches are rejected outright
+        assert register_batch(client, token, []).status_code == 400
+        assert register_batch(client, token, [user(f'user{index}', f'u{index}@example.com') for index in range(11)]).status_code == 413
+        close_app(app)
+
+
+def test_batch_conflicting_with_concurrent_registration():
+    with tempfile.TemporaryDirectory() as directory:
+        app = build_app(directory)
+        client = app.test_client()
+        token = client.post('/auth/register', json=user('admin', 'admin@example.com')).get_json()['access_token']
+        db = app.extensions['sqlalchemy']
+
+        # Another request registers "racer" after the batch checked for conflicts but before it inserts
+        raced = []
+
+        def register_concurrently(session, flush_context, instances):
+            if raced:
+                return
+            raced.append(True)
+            with db.engine.begin() as connection:
+                connection.execute(text(
+                    "INSERT INTO users (username, email, username_lower, email_lower, password_hash, login_count, failed_login_count) "
+                    "VALUES ('Racer', 'racer@example.com', 'racer', 'racer@example.com', 'x', 0, 0)"
+                ))
+
+        with app.app_context():
+            event.listen(db.session, 'before_flush', register_concurrently)
+        response = register_batch(client, token, [user('racer', 'other@example.com'), user('gina', 'gina@example.com')])
+        assert response.status_code == 409, response.get_json()
+
+        # The whole batch was rolled back
+        assert client.post('/auth/login', json={'username': 'gina', 'password': PASSWORD}).status_code == 401
+        close_app(app)
+
+
+if __name__ == '__main__':
+    try:
+        test_batch_results_per_item()
+        test_batch_conflicting_with_concurrent_registration()
+        print("✅ Batch registration reports invalid, conflicting and created items")
+    except AssertionError as e:
+        print(f"❌ Batch registration failed: {e}")
+        sys.exit(1)
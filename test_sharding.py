@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Sharding upgrade test
+Turns sharding on over a database that already has users, then adds a
+shard, and checks users stay reachable and usernames unique before and
+after `rebalance` moves them.
+"""
+
+import os
+import sys
+import tempfile
+
+# Add current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import text
+
+from app import close_app, create_app
+
+PASSWORD = 'SecurePass123'
+
+
+def build_app(directory, shards=0):
+    """App on directory/primary.db, sharded over shards extra SQLite files"""
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{directory}/primary.db',
+        'SHARD_DATABASE_URLS': ','.join(f'sqlite:///{directory}/shard{index}.db' for index in range(shards)),
+        'BCRYPT_ROUNDS': 4,
+        'PASSWORD_POOL_WORKERS': 0,
+        'LOGIN_THROTTLE': False,
+        'JOBS_WORKERS': 0
+    })
+
+
+def register(client, username, email):
+    return client.post('/auth/register', json={'username': username, 'email': email, 'password': PASSWORD})
+
+
+def login(client, identifier):
+    return client.post('/auth/login', json={'username': identifier, 'password': PASSWORD})
+
+
+def listed_usernames(client, token):
+    response = client.get('/users/?limit=100', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200, response.get_json()
+    return {user['username'] for user in response.get_json()['users']}
+
+
+def test_existing_users_survive_enabling_sharding():
+    with tempfile.TemporaryDirectory() as directory:
+        # Users created before sharding live in the primary's users table
+        app = build_app(directory)
+        client = app.test_client()
+        assert register(client, 'OldUser', 'old@example.com').status_code == 201
+        assert register(client, 'alice', 'alice@example.com').status_code == 201
+        close_app(app)
+
+        app = build_app(directory, shards=2)
+        client = app.test_client()
+        router = app.extensions['shard_router']
+        with app.app_context():
+            assert router.primary_has_users()
+
+        # Still on the primary: username login, duplicate checks and listing see them
+        response = login(client, 'olduser')
+        assert response.status_code == 200, response.get_json()
+        token = response.get_json()['access_token']
+        assert login(client, 'old@example.com').status_code == 200
+        assert register(client, 'olduser', 'other@example.com').status_code == 409
+        assert register(client, 'newuser', 'new@example.com').status_code == 201
+        assert listed_usernames(client, token) == {'OldUser', 'alice', 'newuser'}
+
+        # Once moved to their shards they are found there and the primary is no longer read
+        with app.app_context():
+            moved = router.rebalance(include_primary=True)
+            assert sum(moved.values()) == 2
+            assert not router.primary_has_users()
+        assert login(client, 'olduser').status_code == 200
+        assert login(client, 'alice').status_code == 200
+        assert listed_usernames(client, token) == {'OldUser', 'alice', 'newuser'}
+        close_app(app)
+
+
+def test_users_stay_reachable_after_adding_a_shard():
+    with tempfile.TemporaryDirectory() as directory:
+        app = build_app(directory, shards=2)
+        client = app.test_client()
+        usernames = [f'user{index}' for index in range(12)]
+        for username in usernames:
+            assert register(client, username, f'{username}@example.com').status_code == 201
+
+        # A directory from before usernames were recorded is backfilled on the next start
+        with app.app_context(), app.extensions['sqlalchemy'].engine.begin() as connection:
+            connection.execute(text('DROP INDEX ix_user_directory_username_lower'))
+            connection.execute(text('ALTER TABLE user_directory DROP COLUMN username_lower'))
+        close_app(app)
+
+        # The third shard is added without SHARD_REBALANCING
+        app = build_app(directory, shards=3)
+        client = app.test_client()
+        router = app.extensions['shard_router']
+        misplaced = [username for username in usernames if router.shard_for_username(username) == 'shard2']
+        assert misplaced
+
+        response = login(client, misplaced[0])
+        assert response.status_code == 200, response.get_json()
+        token = response.get_json()['access_token']
+        for username in misplaced:
+            assert login(client, username.upper()).status_code == 200
+            response = register(client, username.upper(), f'again-{username}@example.com')
+            assert response.status_code == 409
+            assert response.get_json()['error'] == 'Username already exists'
+
+        with app.app_context():
+            moved = router.rebalance()
+            assert sum(moved.values()) == len(misplaced)
+        for username in usernames:
+            assert login(client, username).status_code == 200
+        assert register(client, misplaced[0], 'again@example.com').status_code == 409
+        assert listed_usernames(client, token) == set(usernames)
+        close_app(app)
+
+
+if __name__ == '__main__':
+    try:
+        test_existing_users_survive_enabling_sharding()
+        test_users_stay_reachable_after_adding_a_shard()
+        print("✅ Users stay reachable and unique across sharding changes until and after rebalancing")
+    except AssertionError as e:
+        print(f"❌ Sharding upgrade failed: {e}")
+        sys.exit(1)
@@ -10,13 +10,13 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 try:
-    from app import app, db
-    print("✅ Successfully imported Flask app and database")
+    from app import create_app
+    print("✅ Successfully imported Flask app factory")
     
-    # Test database initialization
-    with app.app_context():
-        db.create_all()
-        print("✅ Database tables created successfully")
+    # Build the app; tables are created unless the schema is already current
+    app = create_app()
+    startup = app.extensions['startup']
+    print(f"✅ App created in {startup['startup_ms']:.0f}ms (imports {startup['import_ms']:.0f}ms, schema {startup['schema']})")
     
     print("✅ Flask application is ready to run!")
     print("🌐 You can start the server with: python app.py")
@@ -0,0 +1,116 @@
+"""
+Login Throttling
+Token-bucket limits per client IP and per login identifier, checked before
+any database or bcrypt work so credential stuffing cannot burn CPU.
+"""
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+
+class LoginThrottled(Exception):
+    """Raised when a login attempt exceeds its rate limit"""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f'Too many login attempts for this {scope}')
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class ThrottleBackend(ABC):
+    """
+    Storage interface for token buckets. A shared store (e.g. Redis) can
+    replace the in-memory backend by implementing hit(); stats() is optional.
+    """
+
+    @abstractmethod
+    def hit(self, key, capacity, refill_rate):
+        """Take one token from key's bucket; return seconds to wait, or 0 if allowed"""
+
+    def stats(self):
+        """Return backend-specific counters"""
+        return {}
+
+
+class MemoryBackend(ThrottleBackend):
+    """In-process token buckets with LRU eviction to bound memory"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def hit(self, key, capacity, refill_rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * refill_rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0
+            else:
+                retry_after = (1 - tokens) / refill_rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+            return retry_after
+
+    def stats(self):
+        with self._lock:
+            return {'keys': len(self._buckets), 'max_keys': self.max_keys, 'evictions': self.evictions}
+
+
+class LoginThrottle:
+    """Applies separate limits to the client IP and the normalized identifier"""
+
+    def __init__(self, backend, ip_limit=30, ip_window=60, identifier_limit=10, identifier_window=60):
+        self.backend = backend
+        self.limits = {
+            'ip': (ip_limit, ip_limit / ip_window),
+            'identifier': (identifier_limit, identifier_limit / identifier_window)
+        }
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = {'ip': 0, 'identifier': 0}
+
+    @staticmethod
+    def normalize(identifier):
+        """Normalize usernames and emails so case variants share one bucket"""
+        return identifier.strip().lower()
+
+    def check(self, ip, identifier):
+        """Consume one attempt for ip and identifier, raising LoginThrottled if either is exhausted"""
+        for scope, key in (('ip', ip), ('identifier', self.normalize(identifier))):
+            capacity, refill_rate = self.limits[scope]
+            retry_after = self.backend.hit(f'{scope}:{key}', capacity, refill_rate)
+            if retry_after:
+                with self._lock:
+                    self.rejected[scope] += 1
+                raise LoginThrottled(scope, max(1, int(retry_after + 0.999)))
+        with self._lock:
+            self.allowed += 1
+
+    def stats(self):
+        """Return allow/reject counters together with backend stats"""
+        with self._lock:
+            counters = {'allowed': self.allowed, 'rejected': dict(self.rejected)}
+        counters['backend'] = self.backend.stats()
+        return counters
+
+
+def create_login_throttle(config):
+    """Create the login throttle from app config, or None when LOGIN_THROTTLE is off"""
+    if not config.get('LOGIN_THROTTLE', True):
+        return None
+    return LoginThrottle(
+        MemoryBackend(max_keys=config.get('LOGIN_THROTTLE_MAX_KEYS', 100000)),
+        ip_limit=config.get('LOGIN_IP_LIMIT', 30),
+        ip_window=config.get('LOGIN_IP_WINDOW', 60),
+        identifier_limit=config.get('LOGIN_IDENTIFIER_LIMIT', 10),
+        identifier_window=config.get('LOGIN_IDENTIFIER_WINDOW', 60)
+    )